@@ -1,7 +1,23 @@
-# cython: language_level=3
+# cython: language_level=3, freethreading_compatible=True
 cimport cython
-from cpython cimport bool
+from cpython.buffer cimport PyBUF_SIMPLE, PyBuffer_Release, PyObject_GetBuffer
+from cpython.conversion cimport PyOS_string_to_double
+from cpython.unicode cimport (PyUnicode_DATA, PyUnicode_DecodeUTF8, PyUnicode_KIND,
+                              PyUnicode_READ, PyUnicode_Substring, PyUnicode_Tailmatch,
+                              Py_UNICODE_ISALNUM, Py_UNICODE_ISALPHA, Py_UNICODE_ISDIGIT)
+from libc.stdint cimport uint32_t
+from libc.string cimport memcmp
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock, RLock
+from sys import getsizeof, intern
+from time import perf_counter_ns
+import mmap
+import pickle
 import re
+from uuid import UUID
+from weakref import WeakSet
 
 
 class InvalidRoute(Exception):
@@ -10,6 +26,56 @@ class InvalidRoute(Exception):
 
 cdef enum:
     MATCH_DIGIT = 1, MATCH_ALNUM, MATCH_NOSLASH, MATCH_NODASH, MATCH_ALPHA, MATCH_ALL, MATCH_ANY, MATCH_REGEX
+    # Typed placeholders, the captured value is converted, see `capture`.
+    MATCH_INT, MATCH_FLOAT, MATCH_UUID
+
+cdef enum:
+    BYTES_KIND = 0  # Path is UTF-8 encoded bytes; str paths use their PyUnicode kind.
+
+# Flat representation of a compiled tree, see FrozenRoutes. All fields are
+# uint32, so the arrays can be built with array('I') without any padding.
+DEF FROZEN_MAGIC = 0x41524654  # "ARFT"
+DEF FROZEN_VERSION = 2
+DEF NONE = 0xFFFFFFFF  # No route or no regex.
+
+ctypedef struct FrozenHeader:
+    uint32_t magic
+    uint32_t version
+    uint32_t nodes_count
+    uint32_t edges_count
+    uint32_t keys_count
+    uint32_t candidates_count
+    uint32_t chars_count
+    uint32_t bytes_count
+
+ctypedef struct FrozenNode:
+    uint32_t route  # Index in FrozenRoutes.routes, or NONE.
+    uint32_t keys_start  # First char index, as a slice of the keys array.
+    uint32_t keys_count
+    uint32_t fallback_start  # Edges starting with a placeholder, as a slice of the candidates.
+    uint32_t fallback_count
+    uint32_t edges_count
+    uint32_t min_len  # Path length bounds of the subtree, see `Node.compile_bounds`.
+    uint32_t max_len
+    uint32_t max_bytes
+
+ctypedef struct FrozenKey:
+    uint32_t char
+    uint32_t candidates_start
+    uint32_t candidates_count
+
+ctypedef struct FrozenText:
+    uint32_t chars_start  # Code points, to match str paths.
+    uint32_t chars_len
+    uint32_t bytes_start  # UTF-8, to match bytes paths.
+    uint32_t bytes_len
+
+ctypedef struct FrozenEdge:
+    uint32_t child  # Index in the nodes array.
+    uint32_t match_type
+    uint32_t regex  # Index in FrozenRoutes.regexes, or NONE.
+    FrozenText prefix
+    FrozenText suffix
 
 DEFAULT_MATCH_TYPE = 'string'  # Faster default, works for most common use case /{var}/.
 
@@ -18,9 +84,19 @@ MATCH_TYPES = {
     'alpha': MATCH_ALPHA,
     'any': MATCH_ANY,
     'digit': MATCH_DIGIT,
+    'float': MATCH_FLOAT,
+    'int': MATCH_INT,
     DEFAULT_MATCH_TYPE: MATCH_NOSLASH,
     'path': MATCH_ALL,
+    'uuid': MATCH_UUID,
 }
+# HTTP methods with a fixed slot in the routes, see `Routes.match`.
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'CONNECT', 'OPTIONS', 'TRACE', 'PATCH')
+cdef dict METHOD_SLOTS = {method: slot for slot, method in enumerate(METHODS)}
+cdef tuple NO_METHODS = (None,) * len(METHODS)  # Shared by payloads without methods.
+cdef list NO_EDGES = []  # Shared by the nodes without fallback edges, never changed.
+cdef dict NO_INDEX = {}  # Shared by the nodes with a single edge, never changed.
+cdef object PARENTS_LOCK = Lock()  # Guards the parents of every Routes, see Routes.mount.
 PATTERNS = {
     MATCH_ALL: '.+',
     MATCH_ANY: '.*',
@@ -28,7 +104,338 @@ PATTERNS = {
     MATCH_ALPHA: '[a-zA-Z]+',
     MATCH_DIGIT: '\d+',
     MATCH_NOSLASH: '[^/]+',
+    MATCH_INT: '[0-9]+',
+    MATCH_FLOAT: r'[0-9]+(?:\.[0-9]+)?',
+    MATCH_UUID: '[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}',
 }
+# Modes of Routes.match_normalized options.
+NORMALIZE_MODES = (None, 'redirect', 'ignore')
+SLASHES = re.compile('//+')
+SLASHES_BYTES = re.compile(b'//+')
+
+cdef inline bint is_digit(Py_UCS4 char):
+    if char < 128:
+        return u'0' <= char <= u'9'
+    return Py_UNICODE_ISDIGIT(char)
+
+
+cdef inline bint is_alpha(Py_UCS4 char):
+    if char < 128:
+        return u'a' <= char <= u'z' or u'A' <= char <= u'Z'
+    return Py_UNICODE_ISALPHA(char)
+
+
+cdef inline bint is_alnum(Py_UCS4 char):
+    if char < 128:
+        return u'a' <= char <= u'z' or u'A' <= char <= u'Z' or u'0' <= char <= u'9'
+    return Py_UNICODE_ISALNUM(char)
+
+
+cdef inline bint accepts(unsigned int match_type, Py_UCS4 char):
+    if match_type == MATCH_ALPHA:
+        return is_alpha(char)
+    if match_type == MATCH_DIGIT:
+        return is_digit(char)
+    return is_alnum(char)
+
+
+cdef Py_UCS4 decode_utf8(const unsigned char *data, Py_ssize_t i, Py_ssize_t end,
+                         Py_ssize_t *width):
+    """Decode the UTF-8 sequence at `i`, each byte of an invalid sequence is
+    decoded as a lone surrogate, as with the "surrogateescape" error handler."""
+    cdef:
+        unsigned char byte = data[i]
+        unsigned int code, lowest
+        Py_ssize_t size, j
+    width[0] = 1
+    if byte < 0x80:
+        return byte
+    if 0xC2 <= byte < 0xE0:
+        size, code, lowest = 2, byte & 0x1F, 0x80
+    elif 0xE0 <= byte < 0xF0:
+        size, code, lowest = 3, byte & 0x0F, 0x800
+    elif 0xF0 <= byte < 0xF5:
+        size, code, lowest = 4, byte & 0x07, 0x10000
+    else:
+        return 0xDC00 + byte
+    if i + size > end:
+        return 0xDC00 + byte
+    for j in range(i + 1, i + size):
+        if (data[j] & 0xC0) != 0x80:
+            return 0xDC00 + byte
+        code = (code << 6) | (data[j] & 0x3F)
+    # Overlong forms, surrogates and out of range code points are invalid.
+    if code < lowest or 0xD800 <= code <= 0xDFFF or code > 0x10FFFF:
+        return 0xDC00 + byte
+    width[0] = size
+    return code
+
+
+cdef inline Py_UCS4 read_char(int kind, void *data, Py_ssize_t i, Py_ssize_t end):
+    cdef Py_ssize_t width
+    if kind == BYTES_KIND:
+        return decode_utf8(<const unsigned char *>data, i, end, &width)
+    return PyUnicode_READ(kind, data, i)
+
+
+cdef inline bytes to_utf8(str text):
+    """Return `text` as the UTF-8 bytes it matches, lone surrogates standing for
+    the undecodable bytes, as in the captured values (see `substring`)."""
+    return text.encode('utf-8', 'surrogateescape')
+
+
+cdef inline int check_utf8(str path) except -1:
+    """Raise InvalidRoute if `path` can't be matched as UTF-8 bytes, see `to_utf8`."""
+    if not path.isascii():
+        try:
+            to_utf8(path)
+        except UnicodeEncodeError:
+            raise InvalidRoute(f'Can not encode {path!r} in UTF-8') from None
+    return 0
+
+
+cdef inline bytes utf8(str text):
+    """Return `text` encoded in UTF-8, or None if it is ASCII, as its chars then
+    are its UTF-8 bytes, which saves a copy."""
+    return None if text.isascii() else to_utf8(text)
+
+
+cdef inline Py_ssize_t utf8_len(str text, bytes encoded):
+    if encoded is not None:
+        return len(encoded)
+    return len(text) if text is not None else 0
+
+
+cdef inline bint startswith(object path, int kind, void *data, Py_ssize_t start,
+                            Py_ssize_t end, str text, bytes encoded) except -1:
+    """Is `text` in `path` at `start`? `encoded` is `text` encoded in UTF-8, see `utf8`."""
+    cdef Py_ssize_t size
+    if kind == BYTES_KIND:
+        if encoded is None:
+            size = len(text)
+            return (end - start >= size
+                    and not memcmp(<char *>data + start, <char *>PyUnicode_DATA(text), size))
+        size = len(encoded)
+        return end - start >= size and not memcmp(<char *>data + start, <char *>encoded, size)
+    return PyUnicode_Tailmatch(path, text, start, end, -1)
+
+
+cdef inline str substring(object path, int kind, void *data, Py_ssize_t start, Py_ssize_t end):
+    if kind == BYTES_KIND:
+        return PyUnicode_DecodeUTF8(<char *>data + start, end - start, 'surrogateescape')
+    return PyUnicode_Substring(path, start, end)
+
+
+cdef Py_ssize_t match_regex_utf8(object regex, void *data, Py_ssize_t start,
+                                 Py_ssize_t end) except -2:
+    """Match the str `regex` from `start` in an UTF-8 path, as on the decoded path
+    (eg. "." or "{3}" count chars, not bytes), return where it stops, or -1."""
+    cdef:
+        str text = PyUnicode_DecodeUTF8(<char *>data, end, 'surrogateescape')
+        Py_ssize_t char_start = start
+        bint ascii = len(text) == end  # Else offsets in chars and in bytes differ.
+    if not ascii:
+        char_start = len(PyUnicode_DecodeUTF8(<char *>data, start, 'surrogateescape'))
+    matched = regex.match(text, char_start)
+    if matched is None:
+        return -1
+    if ascii:
+        return matched.end()
+    return start + len(to_utf8(text[char_start:matched.end()]))
+
+
+cdef Py_ssize_t consume_utf8(unsigned int match_type, const unsigned char *data, Py_ssize_t i,
+                             Py_ssize_t end):
+    cdef Py_ssize_t width
+    if match_type == MATCH_NOSLASH:
+        while i < end and data[i] != c'/':
+            i += 1
+    elif match_type == MATCH_NODASH:
+        while i < end and data[i] != c'-':
+            i += 1
+    elif match_type == MATCH_ALPHA or match_type == MATCH_DIGIT or match_type == MATCH_ALNUM:
+        while i < end and accepts(match_type, decode_utf8(data, i, end, &width)):
+            i += width
+    else:  # MATCH_ALL and MATCH_ANY.
+        i = end
+    return i
+
+
+cdef Py_ssize_t consume(unsigned int match_type, int kind, void *data, Py_ssize_t i,
+                        Py_ssize_t end):
+    """Return the index of the first char from `i` not accepted by `match_type`."""
+    if match_type == MATCH_INT:
+        return consume_digits(kind, data, i, end)
+    if match_type == MATCH_FLOAT:
+        return consume_float(kind, data, i, end)
+    if match_type == MATCH_UUID:
+        return consume_uuid(kind, data, i, end)
+    if kind == BYTES_KIND:
+        return consume_utf8(match_type, <const unsigned char *>data, i, end)
+    if match_type == MATCH_NOSLASH:
+        while i < end and PyUnicode_READ(kind, data, i) != u'/':
+            i += 1
+    elif match_type == MATCH_ALPHA:
+        while i < end and is_alpha(PyUnicode_READ(kind, data, i)):
+            i += 1
+    elif match_type == MATCH_DIGIT:
+        while i < end and is_digit(PyUnicode_READ(kind, data, i)):
+            i += 1
+    elif match_type == MATCH_ALNUM:
+        while i < end and is_alnum(PyUnicode_READ(kind, data, i)):
+            i += 1
+    elif match_type == MATCH_NODASH:
+        while i < end and PyUnicode_READ(kind, data, i) != u'-':
+            i += 1
+    else:  # MATCH_ALL and MATCH_ANY.
+        i = end
+    return i
+
+
+cdef inline Py_UCS4 ascii_at(int kind, void *data, Py_ssize_t i):
+    """Return the char at `i`, or the byte for a bytes path: only good to test ASCII."""
+    if kind == BYTES_KIND:
+        return (<const unsigned char *>data)[i]
+    return PyUnicode_READ(kind, data, i)
+
+
+cdef inline int hex_value(Py_UCS4 char):
+    if u'0' <= char <= u'9':
+        return <int>char - c'0'
+    if u'a' <= char <= u'f':
+        return <int>char - c'a' + 10
+    if u'A' <= char <= u'F':
+        return <int>char - c'A' + 10
+    return -1
+
+
+cdef inline Py_ssize_t consume_digits(int kind, void *data, Py_ssize_t i, Py_ssize_t end):
+    """Typed placeholders only accept ASCII, unlike `digit`."""
+    while i < end and u'0' <= ascii_at(kind, data, i) <= u'9':
+        i += 1
+    return i
+
+
+cdef Py_ssize_t consume_float(int kind, void *data, Py_ssize_t i, Py_ssize_t end):
+    """Accept "12" or "1.5", but neither ".5" nor "1." nor exponents."""
+    cdef Py_ssize_t j = consume_digits(kind, data, i, end)
+    if j == i or j + 1 >= end or ascii_at(kind, data, j) != u'.':
+        return j
+    if not u'0' <= ascii_at(kind, data, j + 1) <= u'9':
+        return j
+    return consume_digits(kind, data, j + 1, end)
+
+
+cdef Py_ssize_t consume_uuid(int kind, void *data, Py_ssize_t i, Py_ssize_t end):
+    """Accept a UUID in its canonical 8-4-4-4-12 hex digits form, or nothing."""
+    cdef Py_ssize_t j
+    if end - i < 36:
+        return i
+    for j in range(36):
+        if j == 8 or j == 13 or j == 18 or j == 23:
+            if ascii_at(kind, data, i + j) != u'-':
+                return i
+        elif hex_value(ascii_at(kind, data, i + j)) == -1:
+            return i
+    return i + 36
+
+
+cdef object capture(unsigned int match_type, object path, int kind, void *data,
+                    Py_ssize_t start, Py_ssize_t end):
+    """Return the captured value, converted for typed placeholders.
+
+    Values were validated by `consume`, so they are parsed without any
+    intermediate str.
+    """
+    cdef:
+        long long number = 0
+        unsigned long long high = 0, low = 0
+        char buffer[64]
+        Py_ssize_t i
+        int digit
+    if match_type == MATCH_INT:
+        if end - start > 18:  # Could overflow.
+            return int(substring(path, kind, data, start, end))
+        for i in range(start, end):
+            number = number * 10 + (<int>ascii_at(kind, data, i) - c'0')
+        return number
+    if match_type == MATCH_FLOAT:
+        if end - start >= 64:
+            return float(substring(path, kind, data, start, end))
+        for i in range(start, end):
+            buffer[i - start] = <char>ascii_at(kind, data, i)
+        buffer[end - start] = 0
+        return PyOS_string_to_double(buffer, NULL, NULL)
+    if match_type == MATCH_UUID:
+        for i in range(start, end):
+            digit = hex_value(ascii_at(kind, data, i))
+            if digit == -1:  # Dash.
+                continue
+            high = (high << 4) | (low >> 60)
+            low = (low << 4) | digit
+        return UUID(int=(<object>high) << 64 | low)
+    return substring(path, kind, data, start, end)
+
+
+cdef inline uint32_t bounded_sum(uint32_t a, uint32_t b):
+    """Sum two lengths, where NONE means unbounded."""
+    return NONE if a == NONE or b == NONE else a + b
+
+
+cdef tuple placeholder_type(str segment):
+    """Return the match type and regex of a placeholder, eg. "{id:digit"."""
+    cdef:
+        list parts = segment.split(':')
+        str match_type_or_regex = DEFAULT_MATCH_TYPE
+    if len(parts) == 2:
+        match_type_or_regex = parts[1]
+    if match_type_or_regex in MATCH_TYPES:
+        match_type = MATCH_TYPES[match_type_or_regex]
+        return match_type, PATTERNS[match_type]
+    return MATCH_REGEX, match_type_or_regex
+
+
+cdef Py_ssize_t closing_brace(str pattern, Py_ssize_t start):
+    """Return the index of the "}" closing the placeholder opened at `start`, or -1.
+
+    Braces are counted, so that a regex can hold some (eg. "{id:[0-9a-f]{24}}").
+    """
+    cdef:
+        Py_ssize_t i
+        unsigned int depth = 0
+    for i in range(start, len(pattern)):
+        if pattern[i] == u'{':
+            depth += 1
+        elif pattern[i] == u'}':
+            depth -= 1
+            if not depth:
+                return i
+    return -1
+
+
+cdef Py_ssize_t second_placeholder(str pattern):
+    """Return the index where the second placeholder of `pattern` starts, or -1."""
+    cdef Py_ssize_t end = pattern.find('{')
+    if end != -1:
+        end = closing_brace(pattern, end)
+    if end == -1:
+        return -1
+    return pattern.find('{', end + 1)
+
+
+cdef tuple slug_names(str path):
+    """Return the names of the placeholders of `path`, eg. "id" for "{id:digit}"."""
+    cdef:
+        list names = []
+        Py_ssize_t start = path.find('{'), end
+    while start != -1:
+        end = closing_brace(path, start)
+        if end == -1:
+            break
+        names.append(path[start + 1:end].split(':', 1)[0])
+        start = path.find('{', end + 1)
+    return tuple(names)
+
 
 cdef int common_root_len(string1, string2):
     cdef unsigned int bound, i
@@ -43,16 +450,21 @@ cdef int common_root_len(string1, string2):
 @cython.final
 cdef class Edge:
     cdef public str pattern
-    cdef public str regex
     cdef int placeholder_start
     cdef int placeholder_end
     cdef unsigned int pattern_len
     cdef public str prefix
     cdef public str suffix
+    # UTF-8 encoded prefix, to match bytes paths, None when ASCII, see startswith.
+    cdef bytes prefix_bytes
+    cdef bytes suffix_bytes
+    cdef object compiled  # Placeholder regex, for MATCH_REGEX only.
     cdef unsigned int prefix_len
     cdef signed int suffix_len
     cdef public Node child
     cdef public unsigned int match_type
+    cdef unsigned long owner  # Generation that may change it in place, see Node.own.
+    cdef unsigned long regex_tries  # See Routes.stats.
 
     def __init__(self, pattern, child):
         self.pattern = pattern
@@ -62,30 +474,98 @@ cdef class Edge:
     def __repr__(self):
         return '<Edge {}>'.format(self.pattern)
 
-    cdef branch_at(self, unsigned int prefix_len):
+    @property
+    def regex(self):
+        """Regex equivalent to the pattern, computed on demand (eg. for `dump`)."""
+        if self.match_type:
+            segment = self.pattern[self.placeholder_start:self.placeholder_end]
+            return f"^{self.prefix}({placeholder_type(segment)[1]})"
+        return f"^({self.pattern})"
+
+    def __reduce__(self):
+        # Only the compiled properties that are costly to compute are saved.
+        return Edge.__new__, (Edge,), (
+            self.pattern, self.placeholder_start, self.placeholder_end,
+            self.prefix, self.suffix, self.match_type, self.compiled, self.child)
+
+    def __setstate__(self, state):
+        (self.pattern, self.placeholder_start, self.placeholder_end,
+         self.prefix, self.suffix, self.match_type, self.compiled, self.child) = state
+        self.pattern_len = len(self.pattern)
+        self.prefix_len = len(self.prefix)
+        self.prefix_bytes = utf8(self.prefix)
+        if self.suffix is not None:
+            self.suffix_len = len(self.suffix)
+            self.suffix_bytes = utf8(self.suffix)
+
+    cdef Edge own(self, unsigned long generation):
+        """Return the edge, or a copy of it if it can't be changed in `generation`."""
+        cdef Edge edge
+        if self.owner == generation:
+            return self
+        edge = Edge.__new__(Edge)
+        edge.pattern = self.pattern
+        edge.placeholder_start = self.placeholder_start
+        edge.placeholder_end = self.placeholder_end
+        edge.pattern_len = self.pattern_len
+        edge.prefix = self.prefix
+        edge.suffix = self.suffix
+        edge.prefix_bytes = self.prefix_bytes
+        edge.suffix_bytes = self.suffix_bytes
+        edge.compiled = self.compiled
+        edge.prefix_len = self.prefix_len
+        edge.suffix_len = self.suffix_len
+        edge.child = self.child
+        edge.match_type = self.match_type
+        edge.regex_tries = self.regex_tries
+        edge.owner = generation
+        return edge
+
+    cdef branch_at(self, unsigned int prefix_len, unsigned long generation):
         cdef:
             Node new_child = Node()
             str rest = self.pattern[prefix_len:]
-        new_child.connect(self.child, rest)
+        new_child.owner = generation
+        new_child.connect(self.child, rest, generation)
         self.child = new_child
-        new_child.compile()
         self.pattern = self.pattern[:prefix_len]
         self.compile()
 
-    cdef Node join(self, str path):
-        cdef:
-            unsigned int local_index, candidate_index
-            Edge candidate = Edge(path, None)
-        local_index, candidate_index = self.compare(candidate)
-        del candidate
-        if not local_index:
-            return None
+    cdef Node join(self, str path, unsigned int local_index, unsigned int candidate_index,
+                   unsigned long generation):
+        """Insert `path` through this edge, given the result of `compare`."""
         if local_index < self.pattern_len:
-            self.branch_at(local_index)
+            self.branch_at(local_index, generation)
+        else:
+            self.child = self.child.own(generation)
         if candidate_index < len(path):
-            return self.child.insert(path[candidate_index:])
+            return self.child.insert(path[candidate_index:], generation)
         return self.child
 
+    cdef void merge(self, unsigned long generation):
+        """Merge the only edge of the child into this one, inverse of `branch_at`.
+
+        As an edge holds one placeholder at most, patterns with two of them are
+        split before the second one instead, as `Node.insert` would do.
+        """
+        cdef:
+            Edge only = self.child.edges[0]
+            str pattern = self.pattern + only.pattern
+            Py_ssize_t second = second_placeholder(pattern)
+            Edge rest
+        if second == -1:
+            self.pattern = pattern
+            self.child = only.child
+        elif second != self.pattern_len:
+            self.pattern = pattern[:second]
+            rest = Edge(pattern[second:], only.child)
+            rest.owner = generation
+            self.child.edges[0] = rest
+            self.child.dirty = True
+        else:
+            return
+        self.compile()
+
     cdef tuple compare(self, Edge other):
         cdef unsigned int common_len
         if self.prefix_len and other.prefix_len:
@@ -116,288 +596,1771 @@ cdef class Edge:
         placeholder_start=3
         placeholder_end=6
         """
-        cdef:
-            list parts
-            str match_type_or_regex = DEFAULT_MATCH_TYPE
         self.placeholder_start = self.pattern.find('{')  # Slow, but at compile it's ok.
-        self.placeholder_end = self.pattern.find('}')
+        if self.placeholder_start != -1:
+            self.placeholder_end = closing_brace(self.pattern, self.placeholder_start)
+        if self.placeholder_start == -1 or self.placeholder_end == -1:
+            # Flat string, to be compared as a whole, even if it has a "{".
+            self.placeholder_start = self.placeholder_end = -1
         self.pattern_len = len(self.pattern)
-        self.prefix = self.pattern[:self.placeholder_start] if self.placeholder_start != -1 else self.pattern
+        # Many edges share the same prefixes and suffixes (eg. "/users/", ".json").
+        self.pattern = intern(self.pattern)
+        self.prefix = intern(self.pattern[:self.placeholder_start]) if self.placeholder_start != -1 else self.pattern
         self.prefix_len = len(self.prefix)
+        self.prefix_bytes = utf8(self.prefix)
         if self.placeholder_end != -1 and <unsigned>self.placeholder_end < self.pattern_len:
-            self.suffix = self.pattern[self.placeholder_end+1:]
+            self.suffix = intern(self.pattern[self.placeholder_end+1:])
             self.suffix_len = len(self.suffix)
+            self.suffix_bytes = utf8(self.suffix)
         else:
             self.suffix = None
             self.suffix_len = 0
+            self.suffix_bytes = None
+        self.compiled = None
         if self.placeholder_start != -1 and self.placeholder_end != -1:
             segment = self.pattern[self.placeholder_start:self.placeholder_end]
-            parts = segment.split(':')
-            if len(parts) == 2:
-                match_type_or_regex = parts[1]
-            if match_type_or_regex in MATCH_TYPES:
-                self.match_type = MATCH_TYPES.get(match_type_or_regex)
-                self.regex = PATTERNS.get(self.match_type)
-            else:
-                self.match_type = MATCH_REGEX
-                self.regex = match_type_or_regex
-            self.regex = f"^{self.prefix}({self.regex})"
+            self.match_type, regex = placeholder_type(segment)
+            if self.match_type == MATCH_REGEX:
+                self.compiled = re.compile(regex)
         else:  # Flat string.
-            self.regex = f"^({self.pattern})"
             self.match_type = 0  # Reset, in case of branching.
 
-    cdef signed int match(self, str path, signed int path_len, list params):
+    cdef signed int match(self, object path, int kind, void *data, signed int start,
+                          signed int path_len, list params) except -2:
+        """Match the edge against `path` from `start`, return where it stops, or -1."""
         cdef:
-            signed int i = -1
+            signed int i
+            signed int prefix_len = self.prefix_len
+            signed int suffix_len = self.suffix_len
+            signed int capture_start
             signed int consume_until = path_len
-            str capture
+        if kind == BYTES_KIND:  # Lengths are in bytes, not in chars.
+            if self.prefix_bytes is not None:
+                prefix_len = len(self.prefix_bytes)
+            if self.suffix_bytes is not None:
+                suffix_len = len(self.suffix_bytes)
         # Flat match.
         if not self.match_type:
-            if path.startswith(self.pattern):
-                return self.pattern_len
+            if startswith(path, kind, data, start, path_len, self.prefix, self.prefix_bytes):
+                return start + prefix_len
             return -1
         # Placeholder is not at the start (eg. "foo.{ext}").
-        if self.placeholder_start > 0:
-            if not self.prefix == path[:self.placeholder_start]:
+        if prefix_len:
+            if not startswith(path, kind, data, start, path_len, self.prefix, self.prefix_bytes):
                 return -1
-        if self.suffix:
-            if self.suffix_len > path_len:
+        capture_start = start + prefix_len
+        if suffix_len:
+            if suffix_len > path_len - capture_start:
+                return -1
+            consume_until = path_len - suffix_len
+        if self.match_type == MATCH_REGEX:
+            i = self.match_regex(path, kind, data, capture_start, consume_until)
+            if i == -1:
+                return -1
+        else:
+            i = consume(self.match_type, kind, data, capture_start, consume_until)
+            if i == capture_start and self.match_type != MATCH_ANY:
+                return -1
+        if suffix_len:
+            # The placeholder is not at the end (eg. "{name}.json").
+            if not startswith(path, kind, data, i, path_len, self.suffix, self.suffix_bytes):
                 return -1
-            consume_until = path_len - self.suffix_len
-        if self.match_type == MATCH_ALL or self.match_type == MATCH_ANY:
-            i = consume_until
-        elif self.match_type == MATCH_NOSLASH:
-            for i in range(self.placeholder_start, consume_until):
-                if path[i] == '/':
-                    break
-            else:
-                i = consume_until
-        elif self.match_type == MATCH_ALPHA:
-            for i in range(self.placeholder_start, consume_until):
-                if not path[i].isalpha():
-                    break
-            else:
-                i = consume_until
-        elif self.match_type == MATCH_DIGIT:
-            for i in range(self.placeholder_start, consume_until):
-                if not path[i].isdigit():
-                    break
-            else:
-                i = consume_until
-        elif self.match_type == MATCH_ALNUM:
-            for i in range(self.placeholder_start, consume_until):
-                if not path[i].isalnum():
-                    break
-            else:
-                i = consume_until
-        elif self.match_type == MATCH_NODASH:
-            for i in range(self.placeholder_start, consume_until):
-                if path[i] == '-':
-                    break
-            else:
-                i = consume_until
-        if i == 0 and self.match_type != MATCH_ANY:
-            return -1
         # Not all path matched, and edge is a leaf, makes no sense to
         # consume a part of a path
-        if i != path_len and not self.child.edges and not self.suffix_len:
+        if i + suffix_len != path_len and not self.child.edges:
             return -1
-        capture = path[self.placeholder_start:i]
-        if self.suffix_len:
-            # The placeholder is not at the end (eg. "{name}.json").
-            if path[i:i+self.suffix_len] != self.suffix:
-                return -1
-            i = i + self.suffix_len
-        params.append(capture)  # Slow.
-        return i
+        params.append(capture(self.match_type, path, kind, data, capture_start, i))  # Slow.
+        return i + suffix_len
+
+    cdef signed int match_regex(self, object path, int kind, void *data, signed int start,
+                                signed int end) except -2:
+        """Only edges with a custom regex placeholder pay the price of running it."""
+        if kind == BYTES_KIND:
+            return match_regex_utf8(self.compiled, data, start, end)
+        matched = self.compiled.match(path, start, end)
+        return matched.end() if matched else -1
 
 
 cdef class Node:
     cdef public dict payload
     cdef public list edges
     cdef public str path
-    cdef public object regex
-    cdef public str pattern
-    cdef public list slugs
+    cdef public tuple slugs
     cdef unsigned int slugs_count
-    SLUGS = re.compile('{([^:}]+).*?}')
+    cdef public signed int route_id  # Registration index of the route, if any.
+    cdef uint32_t first_route  # Smallest route_id of the subtree, or NONE.
+    cdef public bint dirty  # Node or one of its descendants needs to be compiled.
+    cdef dict index  # Candidate edges per first code point of the path.
+    cdef list fallback  # Edges starting with a placeholder.
+    cdef tuple methods  # Payload values per METHODS slot, None when not allowed.
+    cdef unsigned long owner  # Generation that may change it in place, see Node.own.
+    cdef unsigned long hits  # See Routes.stats.
+    cdef unsigned long misses
+    # Lengths of the paths the subtree can match, NONE when unbounded.
+    cdef uint32_t min_len
+    cdef uint32_t max_len
+    cdef uint32_t max_bytes  # Same as max_len, in UTF-8 bytes.
+    cdef Routes mount  # Routes matching the rest of the path, see Routes.mount.
 
     def __cinit__(self):
-        self.payload = {}
+        self.dirty = True
+        self.route_id = -1
+        self.first_route = NONE
 
     def __repr__(self):
-        return f'<Node {self.path}|{self.pattern}>'
+        return f'<Node {self.path}>'
+
+    def __reduce__(self):
+        return Node.__new__, (Node,), (
+            self.payload, self.edges, self.path, self.slugs, self.route_id, self.first_route,
+            self.mount)
 
-    cdef void attach_route(self, str path, dict payload):
-        self.slugs = Node.SLUGS.findall(path)
+    def __setstate__(self, state):
+        (self.payload, self.edges, self.path, self.slugs, self.route_id, self.first_route,
+         self.mount) = state
+        self.slugs_count = len(self.slugs) if self.slugs else 0
+        if self.route_id != -1:
+            self.methods = method_slots(self.payload)
+        self.compile()
+
+    cdef void attach_route(self, str path, dict payload, dict shared_slugs):
+        """shared_slugs: tuples already used by other routes, to share them."""
+        cdef tuple slugs = slug_names(path)
+        self.slugs = shared_slugs.setdefault(slugs, slugs)
         self.slugs_count = len(self.slugs)
         self.path = path
-        self.payload.update(payload)
+        if self.payload is None:  # Only the nodes with a route have one.
+            self.payload = payload  # Owned by the node, see Routes.insert.
+        else:
+            self.payload.update(payload)
+        self.methods = method_slots(self.payload)
 
-    cdef Edge connect(self, child, pattern):
-        cdef Edge edge
+    cdef void detach_route(self):
+        self.payload = None
+        self.path = None
+        self.slugs = None
+        self.slugs_count = 0
+        self.route_id = -1
+        self.methods = None
+        self.hits = 0
+        self.mount = None
+
+    cdef Node own(self, unsigned long generation):
+        """Return the node, or a copy of it if it can't be changed in `generation`.
+
+        Published nodes are never changed, so that matching needs no lock. Edges
+        are only copied when changed, see `Edge.own`.
+        """
+        cdef Node node
+        if self.owner == generation:
+            return self
+        node = Node.__new__(Node)
+        node.payload = dict(self.payload) if self.payload is not None else None
+        node.edges = list(self.edges) if self.edges is not None else None
+        node.path = self.path
+        node.slugs = self.slugs
+        node.slugs_count = self.slugs_count
+        node.route_id = self.route_id
+        node.first_route = self.first_route
+        node.methods = self.methods
+        node.index = self.index
+        node.fallback = self.fallback
+        node.hits = self.hits
+        node.misses = self.misses
+        node.min_len = self.min_len
+        node.max_len = self.max_len
+        node.max_bytes = self.max_bytes
+        node.mount = self.mount
+        node.dirty = True  # The copy needs its own index.
+        node.owner = generation
+        return node
+
+    cdef object handler(self, str method):
+        """Return the payload value for the HTTP `method`, or None if not allowed."""
+        slot = METHOD_SLOTS.get(method)
+        if slot is None:
+            return self.payload.get(method)
+        return self.methods[slot]
+
+    cdef Edge connect(self, Node child, str pattern, unsigned long generation):
+        cdef:
+            Edge edge
+            Py_ssize_t i
         if not self.edges:
             self.edges = []
-        for edge in self.edges:
+        for i in range(len(self.edges)):
+            edge = self.edges[i]
             if edge.pattern == pattern:
+                edge = self.edges[i] = edge.own(generation)
+                edge.child = edge.child.own(generation)
                 break
         else:
             edge = Edge(pattern=pattern, child=child)
+            edge.owner = generation
             self.edges.append(edge)
         return edge
 
-    cdef Node common_edge(self, str path):
+    cdef Node common_edge(self, str path, unsigned long generation):
         cdef:
             Edge edge
-            Node node
+            Edge candidate
+            Py_ssize_t i
+            unsigned int local_index, candidate_index
         if self.edges:
-            for edge in self.edges:
-                node = edge.join(path)
-                if node:
-                    return node
+            candidate = Edge(path, None)
+            for i in range(len(self.edges)):
+                edge = self.edges[i]
+                local_index, candidate_index = edge.compare(candidate)
+                if local_index:
+                    edge = self.edges[i] = edge.own(generation)
+                    return edge.join(path, local_index, candidate_index, generation)
 
-    cdef Edge match(self, str path, list params):
+    cdef tuple follow(self, str path):
+        """Return the index of the edge `insert` would go through for `path`, and
+        the rest of the path, or (-1, None) if `path` is not in the tree."""
+        cdef:
+            Edge edge
+            Edge candidate = Edge(path, None)
+            Py_ssize_t i
+            unsigned int local_index, candidate_index
+            str pattern = path
+            Py_ssize_t second = second_placeholder(path)
+        if not self.edges:
+            return -1, None
+        if second != -1:
+            pattern = path[:second]
+        for i in range(len(self.edges)):
+            edge = self.edges[i]
+            local_index, candidate_index = edge.compare(candidate)
+            if local_index:
+                if local_index < edge.pattern_len:
+                    # Regexes are not compared, only the prefix: an edge
+                    # registered at once with its regex is followed as is.
+                    if (edge.match_type == MATCH_REGEX and local_index == edge.prefix_len
+                            and edge.pattern == pattern):
+                        return i, path[edge.pattern_len:]
+                    return -1, None  # Would be branched.
+                return i, path[candidate_index:]
+        for i in range(len(self.edges)):
+            if self.edges[i].pattern == pattern:
+                return i, path[len(pattern):]
+        return -1, None
+
+    cdef bint remove(self, str path, unsigned long generation, bint mount=False) except -1:
+        """Detach the route at `path` below this node, pruning the edges leading
+        nowhere. Return whether the route was found.
+
+        mount: detach the routes mounted at `path` instead, see `Routes.mount`
+        """
+        cdef:
+            Edge edge
+            Node child
+            Py_ssize_t i
+        i, rest = self.follow(path)
+        if i == -1:
+            return False
+        edge = self.edges[i] = (<Edge>self.edges[i]).own(generation)
+        child = edge.child = edge.child.own(generation)
+        if rest:
+            if not child.remove(rest, generation, mount):
+                return False
+        elif (child.mount is None) if mount else (child.route_id == -1):
+            return False
+        else:
+            child.detach_route()
+            child.dirty = True
+        self.dirty = True
+        if child.route_id == -1:
+            if not child.edges:
+                del self.edges[i]
+            elif len(child.edges) == 1:
+                edge.merge(generation)
+        return True
+
+    cdef Edge match(self, object path, int kind, void *data, signed int start,
+                    signed int path_len, list params, bint count=False, list mounts=None):
+        """Walk down from this node, and return the edge leading to the matched route.
+
+        count: record the misses and the regexes tried, see `Routes.stats`
+        mounts: list to append the ids of the mounts walked through to
+        """
         cdef:
-            signed int path_len = len(path)
             signed int match_len
+            Py_UCS4 first
+            list candidates
+            Node node = self
             Edge edge
-            object matched
 
-        if self.edges:
-            if self.pattern:  # Non optimizable branching.
-                matched = self.regex.match(path)
-                if matched:
-                    edge = self.edges[matched.lastindex-1]
-                    if edge.placeholder_start != -1:  # Is the capture a slug value?
-                        params.append(matched.group(matched.lastindex))
-                    if matched.end() == path_len and not edge.child.pattern:
-                        if edge.child.path:
-                            return edge
-                    else:
-                        return edge.child.match(path[matched.end():], params)
+        while node.edges:
+            if node.index is None:  # Not compiled yet.
+                return None
+            # No route below can match what remains of the path.
+            if (<uint32_t>(path_len - start) < node.min_len or <uint32_t>(path_len - start)
+                    > (node.max_bytes if kind == BYTES_KIND else node.max_len)):
+                break
+            if start < path_len:
+                first = read_char(kind, data, start, path_len)
+                candidates = node.index.get(<long>first, node.fallback)
             else:
-                for edge in self.edges:
-                    match_len = edge.match(path, path_len, params)
-                    if match_len != -1:
-                        if path_len == match_len and edge.child.path:
-                            return edge
-                        return edge.child.match(path[match_len:], params)
+                candidates = node.fallback
+            for edge in candidates:
+                if count and edge.match_type == MATCH_REGEX:
+                    edge.regex_tries += 1
+                match_len = edge.match(path, kind, data, start, path_len, params)
+                if match_len != -1:
+                    break
+            else:
+                if count:
+                    node.misses += 1
+                return None
+            start = match_len
+            if start == path_len and edge.child.path:
+                if count:
+                    edge.child.hits += 1
+                return edge
+            node = edge.child
+            if node.mount is not None:  # Go on in the mounted routes.
+                if mounts is not None:
+                    mounts.append(node.first_route)
+                node = (<Table>node.mount.published[0]).root
+        if count:
+            node.misses += 1
         return None
 
     cdef void compile(self):
+        self.dirty = False
+        if self.edges:
+            self.compile_index()
+        self.compile_bounds()
+
+    cdef void compile_bounds(self):
+        """Compute the lengths of the paths that can match below this node.
+
+        Paths out of bounds are rejected without trying any edge. Children
+        must be compiled first.
+        """
         cdef:
-            bool has_param = False
-            str pattern = ''
-            unsigned int total = 0
             Edge edge
-        if self.edges:
-            total = len(self.edges)
-            for i, edge in enumerate(self.edges):
-                pattern += edge.regex
-                if edge.pattern.find('{') != -1 and edge.match_type == MATCH_REGEX:
-                    has_param = True
-                if i + 1 < total:
-                    pattern += '|'
+            uint32_t min_len, max_len, max_bytes
+        self.min_len = NONE
+        self.max_len = self.max_bytes = 0
+        if not self.edges:
+            return
+        for edge in self.edges:
+            min_len = edge.prefix_len + edge.suffix_len
+            max_len = min_len
+            max_bytes = utf8_len(edge.prefix, edge.prefix_bytes) + utf8_len(edge.suffix, edge.suffix_bytes)
+            if edge.match_type == MATCH_UUID:
+                min_len += 36
+                max_len += 36
+                max_bytes += 36
+            elif edge.match_type:
+                if edge.match_type != MATCH_ANY and edge.match_type != MATCH_REGEX:
+                    min_len += 1
+                max_len = max_bytes = NONE
+            # Add the shortest and longest ways down from the child.
+            if edge.child.edges and edge.child.route_id == -1:
+                min_len += edge.child.min_len
+            if edge.child.mount is not None:  # Mounted routes may change.
+                max_len = max_bytes = NONE
+            elif edge.child.edges:
+                max_len = bounded_sum(max_len, edge.child.max_len)
+                max_bytes = bounded_sum(max_bytes, edge.child.max_bytes)
+            self.min_len = min(self.min_len, min_len)
+            self.max_len = max(self.max_len, max_len)
+            self.max_bytes = max(self.max_bytes, max_bytes)
 
-            # Run in regex mode only if we have a non optimizable pattern.
-            if has_param:
-                self.pattern = pattern
-                self.regex = re.compile(pattern)
+    cdef void compile_index(self):
+        """Dispatch edges on the first code point of their prefix.
 
-    cdef Node insert(self, str path):
+        Edges without prefix (eg. "{id}") can match any first char, so they are
+        kept in every candidates list, respecting the registration order. A
+        single edge is always the candidate, as it checks its prefix anyway.
+        """
+        cdef:
+            Edge edge
+            list candidates
+            long key
+        if len(self.edges) == 1:
+            self.index = NO_INDEX
+            self.fallback = self.edges
+            return
+        self.index = {}
+        self.fallback = NO_EDGES
+        for edge in self.edges:
+            if edge.prefix_len:
+                key = ord(edge.prefix[0])
+                if key not in self.index:
+                    self.index[key] = list(self.fallback)
+                self.index[key].append(edge)
+            else:
+                if self.fallback is NO_EDGES:
+                    self.fallback = []
+                self.fallback.append(edge)
+                for candidates in self.index.values():
+                    candidates.append(edge)
+
+    cdef Node insert(self, str path, unsigned long generation):
         cdef:
             Node node
             Edge edge = None
             str prefix
-            int bound, end
-            unsigned int nb_slugs
+            Py_ssize_t second
 
-        node = self.common_edge(path)
+        if self.mount is not None:
+            raise InvalidRoute('Can not add a route below mounted routes')
+        self.dirty = True  # We are on the path of the new route.
+        node = self.common_edge(path, generation)
 
         if node:
             return node
 
-        nb_slugs = path.count('{')
-        start = path.find('{')
-        if nb_slugs > 1:
+        second = second_placeholder(path)
+        if second != -1:
             # Break into parts
             child = Node()
-            start = path.find('{', start + 1)  # Goto the next one.
-            self.connect(child, path[:start])
-            return child.insert(path[start:])
+            child.owner = generation
+            edge = self.connect(child, path[:second], generation)
+            return edge.child.insert(path[second:], generation)
         else:
             child = Node()
-            edge = self.connect(child, path)
-            if nb_slugs:
-                if edge.match_type == MATCH_REGEX:  # Non optimizable, split if pattern has prefix or suffix.
-                    if start > 0:  # slug does not start at first char (eg. foo{slug})
-                        edge.branch_at(start)
-                    end = path.find('}')
-                    if end + 1 < len(path):  # slug does not end pattern (eg. {slug}foo)
-                        edge.branch_at(end + 1)
-            return child
+            child.owner = generation
+            edge = self.connect(child, path, generation)
+            return edge.child  # Edge may already exist (eg. same regex placeholder).
+
+
+@cython.final
+cdef class Template:
+    """Route path precompiled for building URLs, see `Routes.url_for`.
+
+    Eg. with path="foo/{id:digit}.json", we would have
+    literals=("foo/", ".json")
+    slugs=("id",)
+    match_types=(MATCH_DIGIT,)
+    """
+    cdef readonly str path
+    cdef tuple literals  # Text around the placeholders, one more than slugs.
+    cdef tuple slugs
+    cdef tuple match_types
+    cdef tuple compiled  # Placeholders regexes, for MATCH_REGEX only.
+    cdef Py_ssize_t slugs_count
+
+    def __cinit__(self, str path):
+        cdef:
+            list literals = []
+            list slugs = []
+            list match_types = []
+            list compiled = []
+            Py_ssize_t start, close, end = -1
+        self.path = path
+        while True:
+            start = path.find('{', end + 1)
+            if start == -1:
+                break
+            close = closing_brace(path, start)
+            if close == -1:  # Unclosed, the rest is literal, as for slug_names.
+                break
+            literals.append(path[end + 1:start])
+            end = close
+            slugs.append(path[start + 1:end].split(':', 1)[0])
+            match_type, regex = placeholder_type(path[start:end])
+            match_types.append(match_type)
+            compiled.append(re.compile(regex) if match_type == MATCH_REGEX else None)
+        literals.append(path[end + 1:])
+        self.literals = tuple(literals)
+        self.slugs = tuple(slugs)
+        self.match_types = tuple(match_types)
+        self.compiled = tuple(compiled)
+        self.slugs_count = len(slugs)
+
+    def __repr__(self):
+        return f'<Template {self.path}>'
+
+    def __reduce__(self):
+        return Template, (self.path,)
+
+    cdef str build(self, dict params):
+        cdef:
+            list parts = [self.literals[0]]
+            Py_ssize_t i
+            unsigned int match_type
+            str value
+        for i in range(self.slugs_count):
+            slug = self.slugs[i]
+            try:
+                value = str(params[slug])
+            except KeyError:
+                raise ValueError(f'Missing param "{slug}" to build "{self.path}"') from None
+            match_type = self.match_types[i]
+            if not (self.compiled[i].fullmatch(value) if match_type == MATCH_REGEX
+                    else accepts_all(match_type, value)):
+                raise ValueError(f'Invalid value {value!r} for "{slug}" in "{self.path}"')
+            parts.append(value)
+            parts.append(self.literals[i + 1])
+        if len(params) > self.slugs_count:
+            unexpected = ', '.join(set(params) - set(self.slugs))
+            if unexpected:
+                raise ValueError(f'Unexpected params to build "{self.path}": {unexpected}')
+        return ''.join(parts)
+
+
+cdef inline bint accepts_all(unsigned int match_type, str value):
+    """Would `value` be entirely captured by a `match_type` placeholder?"""
+    cdef Py_ssize_t length = len(value)
+    if not length:
+        return match_type == MATCH_ANY
+    return consume(match_type, PyUnicode_KIND(value), PyUnicode_DATA(value), 0, length) == length
+
+
+cdef inline tuple method_slots(dict payload):
+    for method in METHODS:
+        if method in payload:
+            return tuple(payload.get(method) for method in METHODS)
+    return NO_METHODS
+
+
+@cython.final
+cdef class Table:
+    """State of the routes, published as a whole, see `Routes.publish`."""
+    cdef Node root
+    cdef dict statics  # Routes without placeholder, for direct lookup.
+    cdef dict statics_bytes  # Same, with UTF-8 encoded paths as keys.
+    cdef dict names  # Route name to Template, see url_for.
+    cdef bint shared  # Dicts are still the ones of the copied table.
+    cdef bint mounted  # Some routes are mounted in the tree, see Routes.mount.
+
+    def __cinit__(self, Node root, dict statics, dict statics_bytes, dict names):
+        self.root = root
+        self.statics = statics
+        self.statics_bytes = statics_bytes
+        self.names = names
+
+    cdef Table copy(self, unsigned long generation):
+        """Return a copy to be changed in `generation`, dicts are copied on write."""
+        cdef Table table = Table(self.root.own(generation), self.statics, self.statics_bytes,
+                                 self.names)
+        table.shared = True
+        table.mounted = self.mounted
+        return table
+
+    cdef void own_dicts(self):
+        if self.shared:
+            self.statics = dict(self.statics)
+            self.statics_bytes = dict(self.statics_bytes)
+            self.names = dict(self.names)
+            self.shared = False
 
 
 cdef class Routes:
+    """Routes table.
 
-    cdef public Node root
+    Matching is lock free: it reads the routes from an immutable `Table`.
+    Changes are made by copying the nodes on the way of the changed routes,
+    and are serialized by a lock. The new table is then published by swapping
+    a single reference, after each `add` (or at the end of a batch), so a
+    concurrent `match` sees either the previous table or the new one. This
+    also holds with free-threaded Python builds.
+    """
 
-    def __cinit__(self):
-        self.root = Node()
+    cdef list published  # Current Table, as a single item, swapped atomically.
+    cdef Table draft  # Copy of the current table being changed, if any.
+    cdef object lock  # Serializes the changes, reentrant for batches.
+    cdef unsigned int batch_depth
+    cdef unsigned int routes_count
+    cdef unsigned long generation  # Incremented by each new draft, see Node.own.
+    cdef unsigned long draft_generation  # Generation the draft started with.
+    cdef bint reordered  # Edges were reordered by the last compile.
+    cdef bint remounted  # Mounts were changed in the draft.
+    cdef object cache  # LRU of match results, when cache_size is set.
+    cdef object cache_lock
+    cdef unsigned int cache_size
+    cdef unsigned long cache_hits
+    cdef unsigned long cache_misses
+    cdef unsigned long cache_evictions
+    cdef unsigned long cache_generation  # Bumped by invalidate, see match.
+    cdef bint counting  # Count hits, misses and regexes tried, see stats.
+    cdef object sampler
+    cdef unsigned int sample_every
+    cdef unsigned int sample_countdown
+    cdef object parents  # Routes mounting these ones, see mount.
+    cdef dict shared_slugs  # Slugs tuples, shared by the routes with the same slugs.
+    cdef object __weakref__
+
+    def __cinit__(self, unsigned int cache_size=0, bint stats=False, sampler=None,
+                  unsigned int sample_every=1000):
+        """cache_size: max number of match results to keep (default: no cache)
+        stats: count the hits per route and the misses, see `stats`
+        sampler: callable to time one match out of `sample_every`, it is given
+                 the path, the matched route id (or -1) and the duration in
+                 nanoseconds
+        """
+        self.published = [Table(Node(), {}, {}, {})]
+        self.lock = RLock()
+        self.cache_size = cache_size
+        if cache_size:
+            self.cache = OrderedDict()
+            self.cache_lock = Lock()
+        self.counting = stats
+        self.sampler = sampler
+        self.sample_every = self.sample_countdown = max(sample_every, 1)
+        self.parents = WeakSet()
+        self.shared_slugs = {}
+
+    def __reduce__(self):
+        # The sampler is not saved, it may not be picklable.
+        cdef Table table = self.published[0]
+        return Routes, (self.cache_size, self.counting), (
+            table.root, self.routes_count, table.statics, table.names)
+
+    def __setstate__(self, state):
+        cdef:
+            str path
+            Node node
+            Table table
+        root, self.routes_count, statics, names = state
+        table = Table(root, statics, {}, names)
+        for path, node in table.statics.items():
+            table.statics_bytes[to_utf8(path)] = node
+        for node in collect_nodes(root):
+            if node.slugs is not None:
+                node.slugs = self.shared_slugs.setdefault(node.slugs, node.slugs)
+        with PARENTS_LOCK:
+            for routes in mounted_routes(root):
+                (<Routes>routes).parents.add(self)
+                table.mounted = True
+        self.published[0] = table
+
+    @property
+    def root(self):
+        """Root node of the current table."""
+        return (<Table>self.published[0]).root
+
+    def dump_bytes(self):
+        """Return a snapshot of the compiled routes, to be loaded with `load_bytes`.
+
+        Payloads must be picklable.
+        """
+        return pickle.dumps(self, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load_bytes(data):
+        """Load a `Routes` instance from a `dump_bytes` snapshot.
+
+        As for any pickle, only load data coming from a trusted source.
+        """
+        routes = pickle.loads(data)
+        if not isinstance(routes, Routes):
+            raise TypeError(f'Expected a Routes snapshot, got {type(routes)}')
+        return routes
 
     def add(self, str path, **payload):
-        """Add a new route
+        """Add a new route, and return its id, see `match_values`.
 
         path: string describing the new route path
         payload: any key/value that would be stored with the new route
         """
+        cdef signed int route_id
+        with self.lock:
+            route_id = self.insert(path, payload)
+            if not self.batch_depth:
+                self.publish()
+        return route_id
+
+    def remove(self, str path):
+        """Remove the route registered for `path`, raise KeyError if there is none."""
+        with self.lock:
+            self.delete(path)
+            if not self.batch_depth:
+                self.publish()
+
+    def mount(self, str prefix, Routes routes):
+        """Match the paths starting with `prefix` with `routes`.
+
+        The mounted routes are not copied nor compiled again: the rest of the
+        path is matched against their current table, so they can be changed
+        (or replaced by mounting others) independently. They are tried in the
+        order the mount was registered, and the ids of their routes are
+        prefixed with the id of the mount, see `match_values`. Routes can't be
+        added at or below `prefix`.
+
+        prefix: static path, with no route at or below it
+        """
+        cdef Node node
+        if not prefix or '{' in prefix or '}' in prefix:
+            raise InvalidRoute(f'Mount prefix must be a static path, got "{prefix}"')
+        check_utf8(prefix)
+        if routes is self or routes.mounts(self):
+            raise ValueError('Routes can not be mounted in themselves')
+        with self.lock:
+            node = self.edit().root.insert(prefix, self.generation)
+            if node.route_id != -1 or node.edges:
+                raise InvalidRoute(f'Can not mount at "{prefix}", routes are registered there')
+            if node.mount is None:
+                node.first_route = self.routes_count
+                self.routes_count += 1
+            node.mount = routes
+            self.remounted = True
+            with PARENTS_LOCK:
+                routes.parents.add(self)
+            if not self.batch_depth:
+                self.publish()
+
+    def unmount(self, str prefix):
+        """Remove the routes mounted at `prefix`, raise KeyError if there are none."""
+        with self.lock:
+            self.delete(prefix, True)
+            self.remounted = True
+            if not self.batch_depth:
+                self.publish()
+
+    cdef bint mounts(self, Routes routes):
+        """Return whether `routes` are mounted in these ones, at any depth."""
+        cdef Node node
+        for node in collect_nodes((<Table>self.published[0]).root):
+            if node.mount is not None and (node.mount is routes or node.mount.mounts(routes)):
+                return True
+        return False
+
+    cdef void invalidate(self):
+        """Clear the match cache, and the ones of the routes mounting these."""
+        if self.cache is not None:
+            with self.cache_lock:
+                self.cache.clear()
+                self.cache_generation += 1
+        with PARENTS_LOCK:
+            parents = list(self.parents)
+        for parent in parents:
+            (<Routes>parent).invalidate()
+
+    def replace(self, routes=(), remove=()):
+        """Apply many changes at once.
+
+        If a path to remove is unknown, KeyError is raised and nothing is
+        changed. Within a batch, the changes are published with the batch.
+
+        routes: iterable of (path, payload) tuples to add; unlike `add`, the
+                payload of an existing route is replaced, not updated
+        remove: iterable of paths to remove, before adding the routes
+        """
+        cdef:
+            Table draft
+            unsigned int routes_count
+        with self.lock:
+            draft = self.draft
+            routes_count = self.routes_count
+            # Work on a copy of the draft, if any, to leave it intact on error.
+            self.edit()
+            if draft is not None:
+                self.generation += 1
+                self.draft = draft.copy(self.generation)
+            try:
+                for path in remove:
+                    self.delete(path)
+                for path, payload in routes:
+                    self.insert(path, dict(payload), False)
+            except BaseException:
+                self.draft = draft
+                self.routes_count = routes_count
+                raise
+            if not self.batch_depth:
+                self.publish()
+
+    def add_named(self, str name, str path, /, **payload):
+        """Same as `add`, but also register the route as `name`, for `url_for`."""
+        cdef:
+            Table draft
+            signed int route_id
+        with self.lock:
+            route_id = self.insert(path, payload)
+            draft = self.draft
+            draft.own_dicts()
+            draft.names[name] = Template(path)
+            if not self.batch_depth:
+                self.publish()
+        return route_id
+
+    def url_for(self, str name, /, **params):
+        """Build the path of the route registered as `name`, with the given params.
+
+        Each param value is converted to str, and must be accepted by its
+        placeholder (eg. only digits for a `digit` one), else ValueError is
+        raised. Values are not escaped.
+        """
+        cdef Template template = (<Table>self.published[0]).names[name]
+        return template.build(params)
+
+    def add_many(self, routes):
+        """Add many routes at once, compiling the tree only once at the end.
+
+        routes: iterable of (path, payload) tuples, payload being a dict
+        """
+        with self.batch():
+            for path, payload in routes:
+                self.insert(path, dict(payload))
+
+    @contextmanager
+    def batch(self):
+        """Defer tree compilation until the end of the block.
+
+        Use it when registering a lot of routes, eg. at startup:
+
+            with routes.batch():
+                for path in paths:
+                    routes.add(path, something='x')
+
+        Routes added within the block can't be matched before it exits, then
+        they are all published at once. Changes from other threads wait for
+        the end of the block.
+        """
+        with self.lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if not self.batch_depth:
+                    self.publish()
+
+    cdef Table edit(self):
+        """Return the draft table, copying the current one if needed."""
+        if self.draft is None:
+            self.generation += 1
+            self.draft_generation = self.generation
+            self.draft = (<Table>self.published[0]).copy(self.generation)
+        return self.draft
+
+    cdef signed int insert(self, str path, dict payload, bint merge=True) except -1:
+        """Register a route, `payload` is kept by the node: pass a copy if needed."""
         cdef Node node
         if path.count('{') != path.count('}'):
             raise InvalidRoute('Unbalanced curly brackets for "{path}"'.format(path=path))
-        node = self.root.insert(path)
-        node.attach_route(path, payload)
-        self.compile(self.root)
+        check_utf8(path)
+        node = self.edit().root.insert(path, self.generation)
+        if node.mount is not None:
+            raise InvalidRoute(f'Can not add "{path}", routes are mounted there')
+        if node.route_id == -1:
+            node.route_id = self.routes_count
+            self.routes_count += 1
+        elif not merge:
+            node.payload = None
+        node.attach_route(path, payload, self.shared_slugs)
+        return node.route_id
+
+    cdef delete(self, str path, bint mount=False):
+        cdef Table draft = self.edit()
+        if not draft.root.remove(path, self.generation, mount):
+            raise KeyError(path)
+        draft.own_dicts()
+        draft.statics.pop(path, None)
+        draft.statics_bytes.pop(to_utf8(path), None)
+        for name, template in list(draft.names.items()):
+            if template.path == path:
+                del draft.names[name]
+
+    cdef void publish(self):
+        """Compile the draft, update the static routes, then make it current.
+
+        A static route is only looked up directly if the tree walk matches it,
+        so that both always agree (eg. a route registered before it may catch
+        its path).
+        """
+        cdef:
+            Table draft = self.draft
+            str path
+            Node node
+            list statics = []
+            set released = None
+        if draft is None:  # Nothing changed.
+            return
+        self.reordered = False
+        self.compile(draft.root)
+        # A reordered node may try any edge before another, check them all.
+        self.collect_statics(draft.root, statics, self.reordered)
+        if statics:
+            draft.own_dicts()
+        for node in statics:
+            path = node.path
+            if self.lookup(draft.root, path) is node:
+                draft.statics[path] = node
+                draft.statics_bytes[to_utf8(path)] = node
+            else:
+                draft.statics.pop(path, None)
+                draft.statics_bytes.pop(to_utf8(path), None)
+        if self.remounted:
+            self.remounted = False
+            mounted = mounted_routes(draft.root)
+            draft.mounted = bool(mounted)
+            released = mounted_routes((<Table>self.published[0]).root) - mounted
+        self.draft = None
+        self.published[0] = draft
+        if released:  # Changes of unmounted routes no longer concern these ones.
+            with PARENTS_LOCK:
+                for routes in released:
+                    (<Routes>routes).parents.discard(self)
+        self.invalidate()
+
+    cdef Node lookup(self, Node root, str path):
+        edge = root.match(path, PyUnicode_KIND(path), PyUnicode_DATA(path), 0, len(path), [])
+        return edge.child if edge is not None else None
+
+    cdef void collect_statics(self, Node node, list found, bint every):
+        """Collect the static routes the tree walk may not match as before: the
+        ones below the nodes changed by the draft, and the ones below an edge
+        that is tried after a changed one (or all of them, with `every`)."""
+        cdef:
+            Edge edge
+            bint fallback = False  # A changed edge may be tried for any path.
+            set firsts = set()  # First chars of the changed edges.
+        if node.route_id != -1 and not node.slugs_count:
+            found.append(node)
+        if not node.edges:
+            return
+        for edge in node.edges:
+            if (every or edge.owner >= self.draft_generation
+                    or edge.child.owner >= self.draft_generation):
+                self.collect_statics(edge.child, found, every)
+                if edge.prefix_len:
+                    firsts.add(edge.prefix[0])
+                else:
+                    fallback = True
+            elif fallback or (firsts and (not edge.prefix_len or edge.prefix[0] in firsts)):
+                self.collect_statics(edge.child, found, True)
+
+    def freeze(self):
+        """Return a read-only copy of the routes, as a `FrozenRoutes`.
+
+        The tree is flattened in contiguous arrays, which use less memory and
+        are more CPU cache friendly. Payloads are copied (shallowly). Routes with
+        mounted routes can't be frozen.
+        """
+        cdef:
+            Node node
+            Node root = (<Table>self.published[0]).root
+            list routes = [None] * self.routes_count
+            list regexes = []
+            bytes table
+        for node in collect_nodes(root):
+            if node.mount is not None:
+                raise ValueError('Routes with mounted routes can not be frozen')
+        table = flatten(root, regexes)
+        for node in collect_nodes(root):
+            if node.route_id != -1:
+                routes[node.route_id] = (dict(node.payload), node.slugs)
+        return FrozenRoutes(table, tuple(routes), tuple(regexes))
+
+    def match(self, str path, str method=None):
+        """Try to find a route that matches `path`, and return the payload if any.
+
+        method: HTTP method, to return the payload value registered for it (eg.
+                `GET=handler`) instead of the whole payload; when the path
+                matches but the method is not allowed, the value is None while
+                params are still returned, to tell a 405 from a 404
+        """
+        cdef:
+            tuple result
+            Node node
+            Table table = self.published[0]
+            unsigned long generation
+            long long started = perf_counter_ns() if self.sampling() else 0
+        if self.cache is None:
+            node, params = self._match(table, path)
+        else:
+            with self.cache_lock:
+                result = self.cache.get(path)
+                if result is not None:
+                    self.cache.move_to_end(path)
+                    self.cache_hits += 1
+                generation = self.cache_generation
+            if result is not None:
+                node, params = result
+                if self.counting and node is not None:
+                    node.hits += 1
+                # Never expose the cached params, the caller may alter them.
+                if params is not None:
+                    params = params.copy()
+            else:
+                # Read after the generation: a table published since then
+                # (here or in mounted routes) has bumped it.
+                table = self.published[0]
+                node, params = self._match(table, path)
+                with self.cache_lock:
+                    self.cache_misses += 1
+                    # Don't cache a result from a table replaced meanwhile.
+                    if generation == self.cache_generation:
+                        self.cache[path] = node, params.copy() if params is not None else None
+                        if len(self.cache) > self.cache_size:
+                            self.cache.popitem(last=False)
+                            self.cache_evictions += 1
+        if started:
+            self.sample(path, node, started, table)
+        if node is None:
+            return None, None
+        if method is None:
+            return node.payload, params
+        return node.handler(method), params
+
+    cdef bint sampling(self):
+        """Is the current match to be timed? See `sampler`."""
+        if self.sampler is None:
+            return False
+        if self.sample_countdown > 1:
+            self.sample_countdown -= 1
+            return False
+        self.sample_countdown = self.sample_every
+        return True
+
+    cdef sample(self, path, Node node, long long started, Table table, list mounts=None):
+        """Call the sampler, `mounts` are walked again if not given."""
+        cdef long long duration = perf_counter_ns() - started
+        if node is not None and table.mounted and mounts is None:
+            mounts = self.walk_mounts(table, path)
+        self.sampler(path, route_key(node, mounts), duration)
+
+    cdef list walk_mounts(self, Table table, path):
+        """Return the ids of the mounts walked through to match `path`."""
+        cdef:
+            list mounts = []
+            Py_buffer view
+        if isinstance(path, str):
+            table.root.match(path, PyUnicode_KIND(path), PyUnicode_DATA(path), 0, len(path), [],
+                             False, mounts)
+        else:
+            PyObject_GetBuffer(path, &view, PyBUF_SIMPLE)
+            try:
+                table.root.match(path, BYTES_KIND, view.buf, 0, view.len, [], False, mounts)
+            finally:
+                PyBuffer_Release(&view)
+        return mounts
+
+    def stats(self):
+        """Return the match counters, when created with `stats=True`.
+
+        hits: number of matches per route path, including unused routes
+        misses: number of paths not found, per prefix of the node where
+                the walk stopped ("" for the root)
+        regex: number of times each custom regex placeholder was tried, per
+               prefix up to it
+
+        Counters are not locked, so they are approximate when matching from
+        many threads at once.
+        """
+        cdef dict hits = {}, misses = {}, regexes = {}
+        self.collect_stats((<Table>self.published[0]).root, '', hits, misses, regexes, False)
+        return {'hits': hits, 'misses': misses, 'regex': regexes}
+
+    def reset_stats(self):
+        """Set all the match counters back to zero."""
+        with self.lock:
+            self.collect_stats((<Table>self.published[0]).root, '', None, None, None, True)
+
+    cdef void collect_stats(self, Node node, str prefix, dict hits, dict misses,
+                            dict regexes, bint reset):
+        cdef Edge edge
+        if reset:
+            node.hits = node.misses = 0
+        else:
+            if node.route_id != -1:
+                hits[node.path] = node.hits
+            if node.misses:
+                misses[prefix] = node.misses
+        if node.edges:
+            for edge in node.edges:
+                if reset:
+                    edge.regex_tries = 0
+                elif edge.regex_tries:
+                    regexes[prefix + edge.pattern] = edge.regex_tries
+                self.collect_stats(edge.child, prefix + edge.pattern, hits, misses, regexes,
+                                   reset)
+
+    def cache_info(self):
+        """Return the match cache statistics."""
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'evictions': self.cache_evictions,
+            'size': len(self.cache) if self.cache is not None else 0,
+            'max_size': self.cache_size,
+        }
+
+    def memory_usage(self):
+        """Return the number of routes, nodes and edges, and the bytes they use.
+
+        Objects shared by many nodes (eg. interned strings) are counted once.
+        Payload values, regexes and mounted routes are not counted.
+        """
+        cdef:
+            Table table = self.published[0]
+            Node node
+            Edge edge
+            set seen = set()
+            dict sizes = dict.fromkeys(
+                ('nodes', 'edges', 'strings', 'indexes', 'payloads', 'statics'), 0)
+            unsigned int routes = 0, edges = 0
+            list nodes = collect_nodes(table.root)
+
+        def count(key, *objects):
+            for obj in objects:
+                if obj is not None and id(obj) not in seen:
+                    seen.add(id(obj))
+                    sizes[key] += getsizeof(obj)
+
+        for node in nodes:
+            count('nodes', node)
+            if node.route_id != -1:
+                routes += 1
+            count('strings', node.path, node.slugs)
+            if node.slugs:
+                count('strings', *node.slugs)
+            count('payloads', node.payload, node.methods)
+            count('indexes', node.edges, node.index, node.fallback)
+            if node.index:
+                count('indexes', *node.index.values())
+            if node.edges:
+                for edge in node.edges:
+                    edges += 1
+                    count('edges', edge)
+                    count('strings', edge.pattern, edge.prefix, edge.suffix,
+                          edge.prefix_bytes, edge.suffix_bytes)
+        count('statics', table.statics, table.statics_bytes, table.names)
+        count('statics', *table.statics_bytes)
+        sizes['total'] = sum(sizes.values())
+        return {'routes': routes, 'nodes': len(nodes), 'edges': edges, 'bytes': sizes}
+
+    def match_bytes(self, path, str method=None):
+        """Same as `match`, but for an UTF-8 encoded path, eg. ASGI "raw_path".
+
+        path: any object supporting the buffer protocol (bytes, bytearray,
+              memoryview...), it is not copied, only the captured values are
+              decoded
+        """
+        cdef:
+            Py_buffer view
+            list values = []
+            Node node = None
+            Table table = self.published[0]
+            long long started = perf_counter_ns() if self.sampling() else 0
+        if type(path) is bytes:
+            node = table.statics_bytes.get(path)
+        if node is not None:
+            params = {}
+            if self.counting:
+                node.hits += 1
+        else:
+            PyObject_GetBuffer(path, &view, PyBUF_SIMPLE)
+            try:
+                edge = table.root.match(path, BYTES_KIND, view.buf, 0, view.len, values,
+                                        self.counting)
+            finally:
+                PyBuffer_Release(&view)
+            node, params = self.resolve(edge, values)
+        if started:
+            self.sample(path, node, started, table)
+        if node is None:
+            return None, None
+        if method is None:
+            return node.payload, params
+        return node.handler(method), params
+
+    def match_values(self, str path):
+        """Same as `match`, but return the route id and the captured values.
+
+        Values are returned as a tuple, in the order of the placeholders in the
+        route path, which saves building the params dict, eg. for frameworks
+        binding them positionally. The id is the one returned by `add`; for a
+        route of mounted routes, it is a tuple of the ids of the mounts walked
+        through, then of the route id in the mounted routes. Return (-1, None)
+        if no route matches.
+        """
+        cdef:
+            list values = []
+            Table table = self.published[0]
+            list mounts = [] if table.mounted else None
+            Node node = table.statics.get(path)
+            Edge edge
+            long long started = perf_counter_ns() if self.sampling() else 0
+        if node is not None:
+            if self.counting:
+                node.hits += 1
+        else:
+            edge = table.root.match(path, PyUnicode_KIND(path), PyUnicode_DATA(path), 0,
+                                    len(path), values, self.counting, mounts)
+            if edge is not None:
+                node = edge.child
+        if started:
+            self.sample(path, node, started, table, mounts)
+        if node is None:
+            return -1, None
+        return route_key(node, mounts), tuple(values)
+
+    def match_normalized(self, path, str method=None, *, bint strip_query=True,
+                         str merge_slashes='redirect', str trailing_slash='redirect'):
+        """Same as `match`, but normalize the path while matching it, and return
+        (payload, params, redirect).
+
+        The path is scanned once for the query string and duplicate slashes, and
+        only copied if it has some; the trailing slash is only toggled when no
+        route matches the path as is.
+
+        path: str, or UTF-8 encoded bytes (eg. ASGI "raw_path")
+        strip_query: ignore the query string, if any
+        merge_slashes: match "/foo//bar" as "/foo/bar"
+        trailing_slash: when no route matches, try with the trailing slash
+                        removed (or added, if there is none)
+        Each mode is one of "redirect", to get the canonical path (with the
+        query string) as `redirect` when it differs from `path`, "ignore", to
+        match silently, or None, to not normalize the path. `redirect` is None
+        when there is no need to redirect.
+        """
+        cdef:
+            Table table = self.published[0]
+            dict statics
+            object matched = path  # Path walked, up to `end` (the query string).
+            void *data
+            int kind
+            Py_ssize_t end, query, i
+            Py_UCS4 char, previous = 0
+            bint merged = False, toggled = False
+            list values = []
+            list mounts = None
+            Node node = None
+            Edge edge
+            long long started
+        if merge_slashes not in NORMALIZE_MODES or trailing_slash not in NORMALIZE_MODES:
+            raise ValueError(f'Modes must be one of {NORMALIZE_MODES}')
+        started = perf_counter_ns() if self.sampling() else 0
+        if started and table.mounted:  # The walked path may differ from `path`.
+            mounts = []
+        if isinstance(path, str):
+            kind = PyUnicode_KIND(path)
+            data = PyUnicode_DATA(path)
+            statics = table.statics
+            slash, slashes = '/', SLASHES
+        else:
+            if type(path) is not bytes:
+                path = matched = bytes(path)
+            kind = BYTES_KIND
+            data = <char *>(<bytes>path)
+            statics = table.statics_bytes
+            slash, slashes = b'/', SLASHES_BYTES
+        query = end = len(path)
+        if strip_query or merge_slashes is not None:
+            for i in range(end):
+                char = ascii_at(kind, data, i)
+                if char == u'?' and strip_query:
+                    query = end = i
+                    break
+                if char == u'/' and previous == u'/' and merge_slashes is not None:
+                    merged = True
+                previous = char
+        if merged:
+            matched = slashes.sub(slash, path[:end])
+            if kind == BYTES_KIND:
+                data = <char *>(<bytes>matched)
+            else:
+                kind = PyUnicode_KIND(matched)
+                data = PyUnicode_DATA(matched)
+            end = len(matched)
+        elif end == len(path):  # Most paths: try the static routes first.
+            node = statics.get(path)
+        if node is None:
+            edge = table.root.match(matched, kind, data, 0, end, values, self.counting, mounts)
+            if edge is None and trailing_slash is not None:
+                del values[:]  # Captured before the walk stopped.
+                if mounts is not None:
+                    del mounts[:]
+                toggled = True
+                if end and ascii_at(kind, data, end - 1) == u'/':
+                    end -= 1
+                else:
+                    matched = matched[:end] + slash
+                    if kind == BYTES_KIND:
+                        data = <char *>(<bytes>matched)
+                    else:
+                        kind = PyUnicode_KIND(matched)
+                        data = PyUnicode_DATA(matched)
+                    end += 1
+                edge = table.root.match(matched, kind, data, 0, end, values, self.counting,
+                                        mounts)
+            node, params = self.resolve(edge, values)
+        else:
+            params = {}
+            if self.counting:
+                node.hits += 1
+        if started:
+            self.sample(path, node, started, table, mounts)
+        if node is None:
+            return None, None, None
+        redirect = None
+        if ((merged and merge_slashes == 'redirect')
+                or (toggled and trailing_slash == 'redirect')):
+            redirect = matched[:end] + path[query:]
+        return (node.payload if method is None else node.handler(method)), params, redirect
+
+    def match_many(self, paths, bint indices=False):
+        """Match each path of the `paths` iterable, and return the list of results.
+
+        All paths are matched against the same table, even if routes are changed
+        meanwhile.
 
-    def match(self, str path):
-        """Try to find a route that matches `path`, and return the payload if any."""
-        return self._match(path)
+        indices: if True, return for each path the index of the matched route in
+                 registration order (a route registered many times keeps its first
+                 index) or -1, instead of the (payload, params) tuple; it is
+                 namespaced for mounted routes, see `match_values`
+        """
+        cdef:
+            str path
+            list results = []
+            Table table = self.published[0]
+        if not indices:
+            for path in paths:
+                node, params = self._match(table, path)
+                results.append((node.payload if node is not None else None, params))
+            return results
+        for path in paths:
+            results.append(self._match_id(table, path))
+        return results
+
+    cdef object _match_id(self, Table table, str path):
+        cdef:
+            Node node = table.statics.get(path)
+            Edge edge
+            list mounts
+        if node is not None:
+            if self.counting:
+                node.hits += 1
+            return node.route_id
+        mounts = [] if table.mounted else None
+        edge = table.root.match(path, PyUnicode_KIND(path), PyUnicode_DATA(path), 0, len(path),
+                                [], self.counting, mounts)
+        return route_key(edge.child, mounts) if edge is not None else -1
 
-    cdef tuple _match(self, str path):
+    cdef tuple _match(self, Table table, str path):
+        """Return the matched node and params, or (None, None)."""
         cdef:
             list values = []
+            Node node = table.statics.get(path)
+        if node is not None:
+            if self.counting:
+                node.hits += 1
+            return node, {}
+        edge = table.root.match(path, PyUnicode_KIND(path), PyUnicode_DATA(path), 0, len(path),
+                                values, self.counting)
+        return self.resolve(edge, values)
+
+    cdef tuple resolve(self, Edge edge, list values):
+        """Return the node matched through `edge`, with the captured params."""
+        cdef:
             dict params = {}
-            list slugs
+            tuple slugs
             unsigned int i
-        edge = self.root.match(path, values)
         if edge:
             slugs = edge.child.slugs
             for i in range(edge.child.slugs_count):
                 params[slugs[i]] = values[i]
-            return edge.child.payload, params
+            return edge.child, params
         return None, None
 
     def dump(self):
         dump(self.root)
 
     cdef compile(self, Node node):
+        """Compile the dirty nodes, only walking down the dirty paths."""
         cdef:
             Edge edge
+            uint32_t previous = 0
+            bint ordered = True
+            list ranks
+            Py_ssize_t i
+        if node.mount is None:  # Else keep the rank given by Routes.mount.
+            node.first_route = node.route_id if node.route_id != -1 else NONE
+        if node.edges:
+            for edge in node.edges:
+                if edge.child.dirty:
+                    self.compile(edge.child)
+                if edge.child.first_route < previous:
+                    ordered = False
+                previous = edge.child.first_route
+                if previous < node.first_route:
+                    node.first_route = previous
+            # Edges are kept in the order of their oldest route, which removing
+            # a route may change.
+            if not ordered:
+                ranks = []
+                for i in range(len(node.edges)):
+                    edge = node.edges[i]
+                    ranks.append((edge.child.first_route, i))
+                ranks.sort()
+                node.edges = [node.edges[i] for _, i in ranks]
+                self.reordered = True
         node.compile()
+
+
+cdef list collect_nodes(Node root):
+    """Return the nodes of the tree, breadth first."""
+    cdef:
+        list nodes = [root]
+        Py_ssize_t i = 0
+        Node node
+        Edge edge
+    while i < len(nodes):
+        node = nodes[i]
         if node.edges:
             for edge in node.edges:
-                self.compile(edge.child)
+                nodes.append(edge.child)
+        i += 1
+    return nodes
+
+
+cdef set mounted_routes(Node root):
+    """Return the routes mounted in the tree (not the ones they mount)."""
+    cdef:
+        set mounted = set()
+        Node node
+    for node in collect_nodes(root):
+        if node.mount is not None:
+            mounted.add(node.mount)
+    return mounted
+
+
+cdef inline object route_key(Node node, list mounts):
+    """Return the id of a matched route, prefixed with the ids of the mounts
+    walked through, if any, see `Routes.match_values`."""
+    if node is None:
+        return -1
+    if not mounts:
+        return node.route_id
+    return tuple(mounts) + (node.route_id,)
+
+
+cdef bytes flatten(Node root, list regexes):
+    """Serialize a compiled tree as a FrozenRoutes table.
+
+    Nodes are numbered breadth first, and edges in the same order, so the
+    child of the edge N is always the node N + 1.
+    """
+    cdef:
+        list nodes = collect_nodes(root)
+        list edges = []
+        dict edge_ids
+        dict texts = {}
+        dict regex_ids = {}
+        Node node
+        Edge edge
+        object node_array = array('I')
+        object edge_array = array('I')
+        object key_array = array('I')
+        object candidates = array('I')
+        object chars = array('I')
+        bytearray utf8 = bytearray()
+        object header
+
+    def add_text(str text):
+        if not text:
+            return 0, 0, 0, 0
+        if text not in texts:  # Share the same strings.
+            encoded = to_utf8(text)
+            texts[text] = len(chars), len(text), len(utf8), len(encoded)
+            chars.extend(ord(char) for char in text)
+            utf8.extend(encoded)
+        return texts[text]
+
+    for node in nodes:
+        if node.edges:
+            edges.extend(node.edges)
+    edge_ids = {id(edge): i for i, edge in enumerate(edges)}
+    for node in nodes:
+        node_array.extend((node.route_id if node.route_id != -1 else NONE,
+                           len(key_array) // 3, len(node.index or ()),
+                           len(candidates), len(node.fallback or ()),
+                           len(node.edges or ()), node.min_len, node.max_len,
+                           node.max_bytes))
+        if not node.edges:
+            continue
+        candidates.extend(edge_ids[id(edge)] for edge in node.fallback)
+        for char in sorted(node.index):  # Sorted for binary search.
+            key_array.extend((char, len(candidates), len(node.index[char])))
+            candidates.extend(edge_ids[id(edge)] for edge in node.index[char])
+    for i, edge in enumerate(edges):
+        if edge.match_type == MATCH_REGEX:
+            if edge.compiled.pattern not in regex_ids:
+                regex_ids[edge.compiled.pattern] = len(regexes)
+                regexes.append(edge.compiled.pattern)
+            regex = regex_ids[edge.compiled.pattern]
+        else:
+            regex = NONE
+        edge_array.extend((i + 1, edge.match_type, regex))
+        edge_array.extend(add_text(edge.prefix))
+        edge_array.extend(add_text(edge.suffix))
+    header = array('I', (FROZEN_MAGIC, FROZEN_VERSION, len(nodes), len(edges),
+                         len(key_array) // 3, len(candidates), len(chars), len(utf8)))
+    return b''.join((header.tobytes(), node_array.tobytes(), edge_array.tobytes(),
+                     key_array.tobytes(), candidates.tobytes(), chars.tobytes(), bytes(utf8)))
+
+
+cdef Py_ssize_t table_size(const void *buf, Py_ssize_t length) except -1:
+    """Validate the header of a FrozenRoutes table, and return the table size."""
+    cdef:
+        const FrozenHeader *header = <const FrozenHeader *>buf
+        Py_ssize_t size
+    if (length < <Py_ssize_t>sizeof(FrozenHeader) or header.magic != FROZEN_MAGIC
+            or header.version != FROZEN_VERSION or not header.nodes_count):
+        raise ValueError('Invalid routes table')
+    size = (sizeof(FrozenHeader) + header.nodes_count * sizeof(FrozenNode)
+            + header.edges_count * sizeof(FrozenEdge) + header.keys_count * sizeof(FrozenKey)
+            + (header.candidates_count + header.chars_count) * sizeof(uint32_t)
+            + header.bytes_count)
+    if length < size:
+        raise ValueError('Invalid routes table')
+    return size
+
+
+cdef class FrozenRoutes:
+    """Read-only routes, flattened in contiguous arrays. See `Routes.freeze`.
+
+    table: buffer holding the arrays
+    routes: (payload, slugs) tuples, indexed by route id (None for removed routes)
+    regexes: custom regex placeholders patterns, indexed by regex id
+    """
+
+    cdef Py_buffer view
+    cdef bint has_view
+    cdef Py_ssize_t size
+    cdef readonly object table
+    cdef readonly tuple routes
+    cdef tuple regexes
+    cdef tuple methods  # METHODS slots, indexed by route id.
+    cdef const FrozenNode *nodes
+    cdef const FrozenEdge *edges
+    cdef const FrozenKey *keys
+    cdef const uint32_t *candidates
+    cdef const uint32_t *chars
+    cdef const unsigned char *utf8
+
+    def __cinit__(self, table, tuple routes, tuple regexes):
+        cdef const FrozenHeader *header
+        PyObject_GetBuffer(table, &self.view, PyBUF_SIMPLE)
+        self.has_view = True
+        self.size = table_size(self.view.buf, self.view.len)
+        header = <const FrozenHeader *>self.view.buf
+        self.nodes = <const FrozenNode *>(header + 1)
+        self.edges = <const FrozenEdge *>(self.nodes + header.nodes_count)
+        self.keys = <const FrozenKey *>(self.edges + header.edges_count)
+        self.candidates = <const uint32_t *>(self.keys + header.keys_count)
+        self.chars = self.candidates + header.candidates_count
+        self.utf8 = <const unsigned char *>(self.chars + header.chars_count)
+        self.table = table
+        self.routes = routes
+        self.methods = tuple(method_slots(route[0]) if route is not None else None
+                             for route in routes)
+        self.regexes = tuple(re.compile(pattern) for pattern in regexes)
+
+    def __dealloc__(self):
+        if self.has_view:
+            PyBuffer_Release(&self.view)
+
+    def __reduce__(self):
+        return FrozenRoutes, (bytes(memoryview(self.table)[:self.size]), self.routes,
+                              tuple(regex.pattern for regex in self.regexes))
+
+    def dump(self, path):
+        """Write the routes to a file, to be loaded with `load`.
+
+        Payloads must be picklable.
+        """
+        with open(path, 'wb') as f:
+            f.write(memoryview(self.table)[:self.size])
+            pickle.dump((self.routes, tuple(regex.pattern for regex in self.regexes)), f,
+                        pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """Load routes written by `dump`, matching directly on the file mapped in memory.
+
+        The mapping is read-only and shared, so the table is only held once in the
+        page cache, whatever the number of processes loading it (only payloads
+        are loaded in each process). As for any pickle, only load files coming
+        from a trusted source.
+        """
+        cdef:
+            Py_buffer view
+            Py_ssize_t size
+        with open(path, 'rb') as f:
+            table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        PyObject_GetBuffer(table, &view, PyBUF_SIMPLE)
+        try:
+            size = table_size(view.buf, view.len)
+        finally:
+            PyBuffer_Release(&view)
+        routes, regexes = pickle.loads(table[size:])
+        return FrozenRoutes(table, routes, regexes)
+
+    def match(self, str path, str method=None):
+        """Try to find a route that matches `path`, see `Routes.match`."""
+        cdef list values = []
+        route = self.walk(path, PyUnicode_KIND(path), PyUnicode_DATA(path), len(path), values)
+        return self.resolve(route, values, method)
+
+    def match_values(self, str path):
+        """Return the route id and the captured values, see `Routes.match_values`."""
+        cdef:
+            list values = []
+            uint32_t route
+        route = self.walk(path, PyUnicode_KIND(path), PyUnicode_DATA(path), len(path), values)
+        if route == NONE:
+            return -1, None
+        return route, tuple(values)
+
+    def match_bytes(self, path, str method=None):
+        """Same as `match`, but for an UTF-8 encoded path, see `Routes.match_bytes`."""
+        cdef:
+            Py_buffer view
+            list values = []
+            uint32_t route
+        PyObject_GetBuffer(path, &view, PyBUF_SIMPLE)
+        try:
+            route = self.walk(path, BYTES_KIND, view.buf, view.len, values)
+        finally:
+            PyBuffer_Release(&view)
+        return self.resolve(route, values, method)
+
+    cdef tuple resolve(self, uint32_t route, list values, str method):
+        cdef:
+            dict params = {}
+            tuple slugs
+            Py_ssize_t i
+        if route == NONE:
+            return None, None
+        payload, slugs = self.routes[route]
+        for i in range(len(slugs)):
+            params[slugs[i]] = values[i]
+        if method is None:
+            return payload, params
+        slot = METHOD_SLOTS.get(method)
+        if slot is None:
+            return payload.get(method), params
+        return self.methods[route][slot], params
+
+    cdef uint32_t walk(self, object path, int kind, void *data, signed int path_len,
+                       list params) except? NONE:
+        """Same as `Node.match`, but return the matched route id, or NONE."""
+        cdef:
+            const FrozenNode *node = self.nodes
+            const FrozenNode *child
+            const FrozenEdge *edge
+            const FrozenKey *key
+            const uint32_t *candidates
+            uint32_t count, i
+            signed int start = 0
+            signed int match_len = -1
+        while node.edges_count:
+            if (<uint32_t>(path_len - start) < node.min_len or <uint32_t>(path_len - start)
+                    > (node.max_bytes if kind == BYTES_KIND else node.max_len)):
+                return NONE
+            candidates = self.candidates + node.fallback_start
+            count = node.fallback_count
+            if start < path_len:
+                key = find_key(self.keys + node.keys_start, node.keys_count,
+                               read_char(kind, data, start, path_len))
+                if key is not NULL:
+                    candidates = self.candidates + key.candidates_start
+                    count = key.candidates_count
+            for i in range(count):
+                edge = self.edges + candidates[i]
+                match_len = self.match_edge(edge, path, kind, data, start, path_len, params)
+                if match_len != -1:
+                    break
+            else:
+                return NONE
+            start = match_len
+            child = self.nodes + edge.child
+            if start == path_len and child.route != NONE:
+                return child.route
+            node = child
+        return NONE
+
+    cdef signed int match_edge(self, const FrozenEdge *edge, object path, int kind, void *data,
+                               signed int start, signed int path_len, list params) except -2:
+        """Same as `Edge.match`."""
+        cdef:
+            signed int i
+            signed int prefix_len = edge.prefix.chars_len
+            signed int suffix_len = edge.suffix.chars_len
+            signed int capture_start
+            signed int consume_until = path_len
+        if kind == BYTES_KIND:
+            prefix_len = edge.prefix.bytes_len
+            suffix_len = edge.suffix.bytes_len
+        # Flat match.
+        if not edge.match_type:
+            if self.startswith(kind, data, start, path_len, &edge.prefix):
+                return start + prefix_len
+            return -1
+        if prefix_len and not self.startswith(kind, data, start, path_len, &edge.prefix):
+            return -1
+        capture_start = start + prefix_len
+        if suffix_len:
+            if suffix_len > path_len - capture_start:
+                return -1
+            consume_until = path_len - suffix_len
+        if edge.match_type == MATCH_REGEX:
+            i = self.match_regex(edge.regex, path, kind, data, capture_start, consume_until)
+            if i == -1:
+                return -1
+        else:
+            i = consume(edge.match_type, kind, data, capture_start, consume_until)
+            if i == capture_start and edge.match_type != MATCH_ANY:
+                return -1
+        if suffix_len and not self.startswith(kind, data, i, path_len, &edge.suffix):
+            return -1
+        if i + suffix_len != path_len and not self.nodes[edge.child].edges_count:
+            return -1
+        params.append(capture(edge.match_type, path, kind, data, capture_start, i))
+        return i + suffix_len
+
+    cdef signed int match_regex(self, uint32_t regex, object path, int kind, void *data,
+                                signed int start, signed int end) except -2:
+        if kind == BYTES_KIND:
+            return match_regex_utf8(self.regexes[regex], data, start, end)
+        matched = self.regexes[regex].match(path, start, end)
+        return matched.end() if matched else -1
+
+    cdef bint startswith(self, int kind, void *data, Py_ssize_t start, Py_ssize_t end,
+                         const FrozenText *text):
+        cdef uint32_t i
+        if kind == BYTES_KIND:
+            return (end - start >= text.bytes_len
+                    and not memcmp(<char *>data + start, self.utf8 + text.bytes_start,
+                                   text.bytes_len))
+        if end - start < text.chars_len:
+            return False
+        for i in range(text.chars_len):
+            if <uint32_t>PyUnicode_READ(kind, data, start + i) != self.chars[text.chars_start + i]:
+                return False
+        return True
+
+
+cdef inline const FrozenKey *find_key(const FrozenKey *keys, uint32_t count, uint32_t char):
+    """Binary search of `char` in the sorted `keys`."""
+    cdef uint32_t low = 0, high = count, middle
+    while low < high:
+        middle = (low + high) >> 1
+        if keys[middle].char < char:
+            low = middle + 1
+        else:
+            high = middle
+    if low < count and keys[low].char == char:
+        return keys + low
+    return NULL
 
 
 cdef dump(node, level=0):
     i = " " * level * 4
     print(f'{i}(o)')
-    if node.pattern:
-        print(f'{i}| regexp: %s' % node.pattern)
     if node.payload:
         print(f'{i}| data: %s' % node.payload)
     if node.path:
         print(f'{i}| path: %s' % node.path)
-        print(f'{i}| slugs: %s' % node.slugs)
+        print(f'{i}| slugs: {node.slugs}')
     if node.edges:
         for edge in node.edges:
             if edge.match_type:
@@ -0,0 +1,174 @@
+import itertools
+import sys
+import threading
+
+import pytest
+
+from autoroutes import Routes
+
+
+@pytest.fixture
+def switch_often():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def run(workers, duration=0.5):
+    errors = []
+    stop = threading.Event()
+
+    def loop(worker):
+        try:
+            while not stop.is_set():
+                worker()
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+
+    threads = [threading.Thread(target=loop, args=(worker,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def test_match_while_adding_and_removing(switch_often):
+    routes = Routes()
+    for i in range(50):
+        routes.add(f'/stable/{i}/{{id}}', data=i)
+        routes.add(f'/static/{i}', data=i)
+
+    def matcher():
+        for i in range(50):
+            assert routes.match(f'/stable/{i}/22') == ({'data': i}, {'id': '22'})
+            assert routes.match(f'/static/{i}') == ({'data': i}, {})
+            payload, params = routes.match(f'/toggled/{i}/22')
+            assert payload in (None, {'data': i})
+
+    def writer(parity):
+        counter = itertools.count()
+
+        def write():
+            i = next(counter) % 25 * 2 + parity
+            routes.add(f'/toggled/{i}/{{id}}', data=i)
+            routes.add(f'/static/{i}/sub', data=i)
+            routes.remove(f'/toggled/{i}/{{id}}')
+            routes.remove(f'/static/{i}/sub')
+
+        return write
+
+    run([matcher] * 4 + [writer(0), writer(1)])
+
+
+def test_replace_is_seen_at_once(switch_often):
+    routes = Routes()
+    paths = [f'/group/{i}/{{id}}' for i in range(20)]
+    values = [f'/group/{i}/22' for i in range(20)]
+    counter = itertools.count()
+
+    def matcher():
+        results = routes.match_many(values, indices=True)
+        assert len(set(result == -1 for result in results)) == 1
+
+    def writer():
+        if not next(counter) % 2:
+            routes.replace([(path, {'data': 'x'}) for path in paths])
+        else:
+            routes.replace(remove=paths)
+
+    run([matcher] * 4 + [writer])
+
+
+def test_batch_is_seen_at_once(switch_often):
+    routes = Routes()
+    counter = itertools.count()
+
+    def matcher():
+        first, second = routes.match_many(['/first', '/second'], indices=True)
+        assert (first == -1) == (second == -1)
+
+    def writer():
+        with routes.batch():
+            if not next(counter) % 2:
+                routes.add('/first', data='x')
+                routes.add('/second', data='y')
+            else:
+                routes.remove('/first')
+                routes.remove('/second')
+
+    run([matcher] * 4 + [writer])
+
+
+def test_match_cache_with_threads(switch_often):
+    routes = Routes(cache_size=10)
+    routes.add('/foo/{id}', data='x')
+    calls = []
+
+    def matcher():
+        for i in range(20):
+            assert routes.match(f'/foo/{i % 12}') == ({'data': 'x'}, {'id': str(i % 12)})
+        calls.append(20)
+
+    run([matcher] * 4)
+    info = routes.cache_info()
+    assert info['size'] == 10
+    # Each match is counted once, either as a hit or as a miss.
+    assert info['hits'] + info['misses'] == sum(calls)
+    assert info['hits'] > 0
+
+
+def test_mount_while_mounted_routes_change(switch_often):
+    routes = Routes(cache_size=10)
+    blog = Routes()
+    blog.add('/{slug}', data='post')
+
+    def matcher():
+        assert routes.match('/blog/hello') == ({'data': 'post'}, {'slug': 'hello'})
+
+    def mounter(name):
+        counter = itertools.count()
+
+        def mount():
+            prefix = f'/{name}/{next(counter) % 10}'
+            routes.mount(prefix, blog)
+            routes.unmount(prefix)
+
+        return mount
+
+    def writer():
+        blog.add('/{year:int}/{slug}', data='dated')
+        blog.remove('/{year:int}/{slug}')
+
+    routes.mount('/blog', blog)
+    run([matcher] * 2 + [mounter('a'), mounter('b'), writer])
+    assert routes.match('/blog/hello') == ({'data': 'post'}, {'slug': 'hello'})
+
+
+def test_match_cache_with_mounted_routes_changing(switch_often):
+    routes = Routes(cache_size=100)
+    blog = Routes()
+    routes.mount('/blog', blog)
+    paths = [f'/post{i}' for i in range(5)]
+    counter = itertools.count()
+
+    def matcher():
+        for path in paths:
+            payload, params = routes.match('/blog' + path)
+            assert payload in (None, {'data': 'post'})
+
+    def writer():
+        if not next(counter) % 2:
+            blog.add('/{slug}', data='post')
+        else:
+            blog.remove('/{slug}')
+
+    run([matcher] * 4 + [writer])
+    # No result of a previous table of the mounted routes is kept.
+    for path in paths:
+        assert routes.match('/blog' + path) == blog.match(path)
@@ -17,11 +17,19 @@ def test_edge_compile(pattern, expected):
     assert edge.regex == expected
 
 
+def test_edge_compile_unclosed_placeholder_is_flat():
+    edge = Edge('bar/{id', Node())
+    assert edge.match_type == 0
+    assert edge.prefix == 'bar/{id'
+    assert edge.suffix is None
+
+
 def test_edge_insert_same_path(routes):
     routes.add('/foo', x='1')
     root = routes.root
     assert len(root.edges) == 1
     routes.add('/foo', y='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert root.edges[0].child.payload == {'x': '1', 'y': '2'}
 
@@ -31,6 +39,7 @@ def test_edge_insert_prefix_vs_placeholder(routes):
     root = routes.root
     assert len(root.edges) == 1
     routes.add('{foo}', x='2')
+    root = routes.root
     assert len(root.edges) == 2
     assert root.edges[0].child.payload == {'x': '1'}
     assert root.edges[1].child.payload == {'x': '2'}
@@ -42,6 +51,7 @@ def test_edge_join_longer_path(routes):
     assert len(root.edges) == 1
     assert not root.edges[0].child.edges
     routes.add('/foo/bar', x='2')
+    root = routes.root
     leaf = root.edges[0].child
     assert leaf.payload == {'x': '1'}
     assert root.edges[0].pattern == '/foo'
@@ -56,6 +66,7 @@ def test_edge_join_shorter_path(routes):
     assert len(root.edges) == 1
     assert root.edges[0].pattern == '/foo/bar'
     routes.add('/foo', x='2')
+    root = routes.root
     assert len(root.edges) == 1
     leaf = root.edges[0].child
     assert leaf.payload == {'x': '2'}
@@ -72,6 +83,7 @@ def test_edge_join_same_root(routes):
     assert len(root.edges) == 1
     assert root.edges[0].pattern == '/foo/bar'
     routes.add('/foo/baz', x='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert not root.edges[0].child.payload
     assert root.edges[0].pattern == '/foo/ba'
@@ -89,6 +101,7 @@ def test_edge_insert_same_path_and_placeholder(routes):
     root = routes.root
     assert len(root.edges) == 1
     routes.add('/foo/{bar}', y='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert root.edges[0].child.payload == {'x': '1', 'y': '2'}
 
@@ -98,6 +111,7 @@ def test_edge_insert_same_path_and_placeholder_type(routes):
     root = routes.root
     assert len(root.edges) == 1
     routes.add('/foo/{bar:digit}', y='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert root.edges[0].child.payload == {'x': '1', 'y': '2'}
 
@@ -107,6 +121,7 @@ def test_edge_insert_same_path_and_placeholder_type_w_different_name(routes):
     root = routes.root
     assert len(root.edges) == 1
     routes.add('/foo/{baz:digit}', y='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert root.edges[0].child.payload == {'x': '1', 'y': '2'}
 
@@ -116,6 +131,7 @@ def test_edge_insert_same_prefix_and_different_placeholder(routes):
     root = routes.root
     assert len(root.edges) == 1
     routes.add('/foo/{bar:string}', x='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert root.edges[0].pattern == '/foo/'
     assert len(root.edges[0].child.edges) == 2
@@ -130,6 +146,7 @@ def test_edge_insert_same_prefix_and_different_placeholder_and_suffix(routes):
     root = routes.root
     assert len(root.edges) == 1
     routes.add('/foo/{bar:string}/baz', x='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert root.edges[0].pattern == '/foo/'
     assert len(root.edges[0].child.edges) == 2
@@ -145,6 +162,7 @@ def test_edge_join_longer_prefix_with_local_placeholder(routes):
     assert len(root.edges) == 1
     assert not root.edges[0].child.edges
     routes.add('/foo/baz', x='2')
+    root = routes.root
     assert root.edges[0].pattern == '/foo/'
     assert not root.edges[0].child.payload
     leaf = root.edges[0].child.edges[0].child
@@ -161,6 +179,7 @@ def test_edge_join_longer_prefix_with_local_placeholder2(routes):
     assert len(root.edges) == 1
     assert not root.edges[0].child.edges
     routes.add('/foo/bar', x='2')
+    root = routes.root
     assert root.edges[0].pattern == '/foo/ba'
     assert not root.edges[0].child.payload
     leaf = root.edges[0].child.edges[0].child
@@ -177,6 +196,7 @@ def test_edge_join_longer_prefix_with_remote_placeholder(routes):
     assert len(root.edges) == 1
     assert not root.edges[0].child.edges
     routes.add('/foo/{bar}', x='2')
+    root = routes.root
     assert root.edges[0].pattern == '/foo/'
     assert not root.edges[0].child.payload
     leaf = root.edges[0].child.edges[0].child
@@ -193,6 +213,7 @@ def test_edge_join_longer_prefix_with_remote_placeholder2(routes):
     assert len(root.edges) == 1
     assert not root.edges[0].child.edges
     routes.add('/foo/baz/{bar}', x='2')
+    root = routes.root
     assert root.edges[0].pattern == '/foo/ba'
     assert not root.edges[0].child.payload
     leaf = root.edges[0].child.edges[0].child
@@ -208,6 +229,7 @@ def test_edge_insert_same_path_placeholder_and_suffix(routes):
     root = routes.root
     assert len(root.edges) == 1
     routes.add('/foo/{bar}/baz', y='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert root.edges[0].child.payload == {'x': '1', 'y': '2'}
 
@@ -218,6 +240,7 @@ def test_edge_join_longer_suffix(routes):
     assert len(root.edges) == 1
     assert not root.edges[0].child.edges
     routes.add('/foo/{bar}/baz', x='2')
+    root = routes.root
     leaf = root.edges[0].child
     assert leaf.payload == {'x': '1'}
     assert root.edges[0].pattern == '/foo/{bar}/'
@@ -232,6 +255,7 @@ def test_edge_join_shorter_suffix(routes):
     assert len(root.edges) == 1
     assert root.edges[0].pattern == '/foo/{bar}/baz'
     routes.add('/foo/{bar}/', x='2')
+    root = routes.root
     assert root.edges[0].pattern == '/foo/{bar}/'
     assert len(root.edges) == 1
     leaf = root.edges[0].child
@@ -249,6 +273,7 @@ def test_edge_join_same_suffix_root(routes):
     assert len(root.edges) == 1
     assert root.edges[0].pattern == '/foo/{bar}/bar'
     routes.add('/foo/{bar}/baz', x='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert not root.edges[0].child.payload
     assert root.edges[0].pattern == '/foo/{bar}/ba'
@@ -266,6 +291,7 @@ def test_edge_insert_same_placeholder_and_suffix(routes):
     root = routes.root
     assert len(root.edges) == 1
     routes.add('{bar}/foo', y='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert root.edges[0].child.payload == {'x': '1', 'y': '2'}
 
@@ -276,6 +302,7 @@ def test_edge_insert_same_placeholder_with_different_suffix(routes):
     assert len(root.edges) == 1
     assert root.edges[0].child.payload == {'x': '1'}
     routes.add('{bar}/bar', y='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert not root.edges[0].child.payload
     assert len(root.edges[0].child.edges) == 2
@@ -289,7 +316,97 @@ def test_edge_insert_same_placeholder_with_one_suffix(routes):
     assert len(root.edges) == 1
     assert root.edges[0].child.payload == {'x': '1'}
     routes.add('{bar}/bar', y='2')
+    root = routes.root
     assert len(root.edges) == 1
     assert root.edges[0].child.payload == {'x': '1'}
     assert len(root.edges[0].child.edges) == 1
     assert root.edges[0].child.edges[0].child.payload == {'y': '2'}
+
+
+def test_add_only_copies_the_new_route_path(routes):
+    routes.add('/foo/{id}/bar', x='1')
+    routes.add('/bar/{id}/baz', x='2')
+    root = routes.root
+    foo = root.edges[0].child.edges[0]
+    bar = root.edges[0].child.edges[1]
+    with routes.batch():
+        routes.add('/foo/{id}/baz', x='3')
+        assert routes.root is root  # Not published yet.
+    assert routes.root is not root
+    assert not routes.root.dirty
+    assert routes.root.edges[0].child.edges[0] is not foo
+    assert routes.root.edges[0].child.edges[1] is bar
+    # The previous tree is left untouched.
+    assert foo.pattern == 'foo/{id}/bar'
+    assert not foo.child.edges
+    assert routes.match('/foo/22/baz') == ({'x': '3'}, {'id': '22'})
+    assert routes.match('/bar/22/baz') == ({'x': '2'}, {'id': '22'})
+
+
+def test_branching_leaves_no_dirty_node(routes):
+
+    def dirty(node):
+        return node.dirty or any(dirty(e.child) for e in node.edges or [])
+
+    routes.add('/foo/{id}', x='1')
+    routes.add(r'/foo/{id:\d+}.json', x='2')
+    routes.add(r'/foo/{id:[a-z]+}.xml', x='3')
+    assert not dirty(routes.root)
+    assert routes.match('/foo/bar') == ({'x': '1'}, {'id': 'bar'})
+
+
+def test_remove_leaf_merges_single_child(routes):
+    routes.add('/foo/bar', x='1')
+    routes.add('/foo/baz', x='2')
+    assert routes.root.edges[0].pattern == '/foo/ba'
+    routes.remove('/foo/baz')
+    root = routes.root
+    assert len(root.edges) == 1
+    assert root.edges[0].pattern == '/foo/bar'
+    assert root.edges[0].child.payload == {'x': '1'}
+
+
+def test_remove_inner_route_merges_single_child(routes):
+    routes.add('/foo/{bar}/', x='1')
+    routes.add('/foo/{bar}/baz', x='2')
+    routes.remove('/foo/{bar}/')
+    root = routes.root
+    assert len(root.edges) == 1
+    assert root.edges[0].pattern == '/foo/{bar}/baz'
+    assert root.edges[0].child.payload == {'x': '2'}
+
+
+def test_remove_does_not_merge_two_placeholders(routes):
+    routes.add('/foo/{bar}/{baz}', x='1')
+    routes.add('/foo/{bar}/', x='2')
+    routes.remove('/foo/{bar}/')
+    root = routes.root
+    assert root.edges[0].pattern == '/foo/{bar}/'
+    assert root.edges[0].child.edges[0].pattern == '{baz}'
+
+
+def test_remove_prunes_empty_branches(routes):
+    routes.add('/foo/{bar}/baz/qux', x='1')
+    routes.add('/foo/{bar}/baz/{qux}/quux', x='2')
+    routes.remove('/foo/{bar}/baz/{qux}/quux')
+    root = routes.root
+    assert len(root.edges) == 1
+    assert root.edges[0].pattern == '/foo/{bar}/baz/qux'
+    routes.remove('/foo/{bar}/baz/qux')
+    assert not routes.root.edges
+
+
+def test_replace_copies_only_the_changed_path(routes):
+    routes.add('/foo/{id}', x='1')
+    routes.add('/bar/{id}', x='2')
+    root = routes.root
+    foo = root.edges[0].child.edges[0]
+    bar = root.edges[0].child.edges[1]
+    routes.replace([('/foo/{id}/baz', {'x': '3'})])
+    assert routes.root is not root
+    # The previous tree is left untouched.
+    assert root.edges[0].child.edges[0] is foo
+    assert not foo.child.edges
+    # Unchanged branches are shared.
+    assert routes.root.edges[0].child.edges[1] is bar
+    assert routes.root.edges[0].child.edges[0] is not foo
@@ -0,0 +1,110 @@
+import mmap
+import pickle
+
+import pytest
+from autoroutes import FrozenRoutes, Routes
+
+
+PATHS = [
+    '/foo', '/foo/bar', '/foo/22/bar', '/foo/22.json', '/foo/22.xml',
+    '/foo/ab.xml', '/éèà/àéè', '/alpha/àéè', '/alpha/à.è', '/digit/123',
+    '/digit/12a', '/regex/b', '/regex/12', '/regex/abc', '/any/', '/any/a/b',
+    '/nowhere', '', '/foo/id/bar/su', '/foo/id/su', '/f', '/foo/',
+    '/int/12', '/int/1a', '/float/1.5', '/uuid/12345678-1234-5678-9abc-def012345678',
+]
+
+
+@pytest.fixture
+def frozen(routes):
+    routes.add('/foo', data='static')
+    routes.add('/foo/{id}/bar', data='middle')
+    routes.add('/foo/{id}.json', data='suffix')
+    routes.add(r'/foo/{id:\d+}.xml', data='regex suffix')
+    routes.add('/éèà/{name}', data='unicode')
+    routes.add('/alpha/{name:alpha}', data='alpha')
+    routes.add('/digit/{id:digit}', data='digit')
+    routes.add('/regex/{id:[abc]}', data='regex')
+    routes.add('/regex/{id:digit}', data='regex digit')
+    routes.add('/any/{path:any}', data='any')
+    routes.add('/foo/{id}/bar/{sub}', data='multiple')
+    routes.add('/foo/{id}/{sub}', data='succession')
+    routes.add('/int/{id:int}', data='int')
+    routes.add('/float/{ratio:float}', data='float')
+    routes.add('/uuid/{uid:uuid}', data='uuid')
+    return routes.freeze()
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_frozen_match(routes, frozen, path):
+    assert frozen.match(path) == routes.match(path)
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_frozen_match_bytes(routes, frozen, path):
+    assert frozen.match_bytes(path.encode()) == routes.match(path)
+
+
+def test_frozen_is_not_affected_by_later_changes(routes):
+    routes.add('/foo/{id}', data='x')
+    frozen = routes.freeze()
+    routes.add('/foo/{id}', data='y')
+    routes.add('/bar', data='z')
+    assert frozen.match('/foo/22') == ({'data': 'x'}, {'id': '22'})
+    assert frozen.match('/bar') == (None, None)
+
+
+def test_frozen_empty_routes(routes):
+    assert routes.freeze().match('/foo') == (None, None)
+
+
+def test_frozen_rejects_invalid_table():
+    with pytest.raises(ValueError):
+        FrozenRoutes(b'invalid', (), ())
+    with pytest.raises(ValueError):
+        FrozenRoutes(bytes(32), (), ())
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_frozen_dump_and_load(routes, frozen, path, tmp_path):
+    frozen.dump(tmp_path / 'routes.bin')
+    loaded = FrozenRoutes.load(tmp_path / 'routes.bin')
+    assert isinstance(loaded.table, mmap.mmap)
+    assert loaded.match(path) == routes.match(path)
+    assert loaded.match_bytes(path.encode()) == routes.match(path)
+
+
+def test_frozen_load_is_read_only(routes, tmp_path):
+    routes.add('/foo/{id}', data='x')
+    routes.freeze().dump(tmp_path / 'routes.bin')
+    loaded = FrozenRoutes.load(tmp_path / 'routes.bin')
+    with pytest.raises(TypeError):
+        loaded.table[0] = 0
+    assert loaded.match('/foo/bar') == ({'data': 'x'}, {'id': 'bar'})
+
+
+def test_frozen_load_rejects_invalid_file(tmp_path):
+    (tmp_path / 'routes.bin').write_bytes(b'invalid')
+    with pytest.raises(ValueError):
+        FrozenRoutes.load(tmp_path / 'routes.bin')
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_frozen_pickle(routes, frozen, path):
+    assert pickle.loads(pickle.dumps(frozen)).match(path) == routes.match(path)
+
+
+def test_frozen_match_method(routes):
+    routes.add('/foo/{id}', GET='get', PROPFIND='propfind')
+    routes.add('/bar', POST='post')
+    frozen = routes.freeze()
+    assert frozen.match('/foo/22', method='GET') == ('get', {'id': '22'})
+    assert frozen.match('/foo/22', method='PROPFIND') == ('propfind', {'id': '22'})
+    assert frozen.match('/foo/22', method='POST') == (None, {'id': '22'})
+    assert frozen.match_bytes(b'/bar', method='POST') == ('post', {})
+    assert frozen.match_bytes(b'/bar', method='GET') == (None, {})
+    assert frozen.match('/baz', method='GET') == (None, None)
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_frozen_match_values(routes, frozen, path):
+    assert frozen.match_values(path) == routes.match_values(path)
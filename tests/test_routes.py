@@ -1,6 +1,9 @@
 
+import pickle
+import uuid
+
 import pytest
-from autoroutes import InvalidRoute
+from autoroutes import InvalidRoute, Routes
 
 
 def test_simple_follow(routes):
@@ -132,6 +135,42 @@ def test_variable_type_is_alpha(routes):
     assert routes.match('/foo/a2')[1] is None
 
 
+def test_variable_type_is_int(routes):
+    routes.add('/foo/{id:int}', something='x')
+    assert routes.match('/foo/22') == ({'something': 'x'}, {'id': 22})
+    assert routes.match('/foo/0022')[1] == {'id': 22}
+    assert routes.match('/foo/12345678901234567890')[1] == {'id': 12345678901234567890}
+    assert routes.match('/foo/22a')[1] is None
+    assert routes.match('/foo/-2')[1] is None
+    assert routes.match('/foo/١٢')[1] is None  # Unlike digit, only ASCII.
+
+
+def test_variable_type_is_float(routes):
+    routes.add('/foo/{ratio:float}.json', something='x')
+    assert routes.match('/foo/1.5.json')[1] == {'ratio': 1.5}
+    assert routes.match('/foo/2.json')[1] == {'ratio': 2.0}
+    assert routes.match('/foo/.5.json')[1] is None
+    assert routes.match('/foo/1..json')[1] is None
+    assert routes.match('/foo/1e3.json')[1] is None
+
+
+def test_variable_type_is_uuid(routes):
+    routes.add('/foo/{uid:uuid}/bar', something='x')
+    uid = uuid.uuid4()
+    assert routes.match(f'/foo/{uid}/bar')[1] == {'uid': uid}
+    assert routes.match(f'/foo/{str(uid).upper()}/bar')[1] == {'uid': uid}
+    assert routes.match(f'/foo/{uid.hex}/bar')[1] is None
+    assert routes.match(f'/foo/{str(uid)[:-1]}/bar')[1] is None
+    assert routes.match(f'/foo/{str(uid)[:-1]}g/bar')[1] is None
+
+
+def test_typed_variable_falls_back_to_next_route(routes):
+    routes.add('/foo/{id:int}', data='int')
+    routes.add('/foo/{name}', data='string')
+    assert routes.match('/foo/22') == ({'data': 'int'}, {'id': 22})
+    assert routes.match('/foo/bar') == ({'data': 'string'}, {'name': 'bar'})
+
+
 def test_add_segment_can_mix_string_and_param(routes):
     routes.add('/foo.{ext}', data='x')
     assert routes.match('/foo.json')[1] == {'ext': 'json'}
@@ -277,3 +316,949 @@ def test_variables_without_slash_should_not_match_slash(routes):
     routes.add('root/{foo}', data="one")
     routes.add('root/foo/{bar}', data="two")
     assert routes.match('root/foo/123') == ({"data": "two"}, {"bar": "123"})
+
+
+def test_add_many(routes):
+    routes.add_many([
+        ('/foo/{id:digit}', {'data': 'x'}),
+        ('/foo/{id}/bar', {'data': 'y'}),
+        ('/bar/{id}.json', {'data': 'z'}),
+    ])
+    assert routes.match('/foo/22') == ({'data': 'x'}, {'id': '22'})
+    assert routes.match('/foo/abc/bar') == ({'data': 'y'}, {'id': 'abc'})
+    assert routes.match('/bar/22.json') == ({'data': 'z'}, {'id': '22'})
+
+
+def test_add_many_validates_routes(routes):
+    with pytest.raises(InvalidRoute):
+        routes.add_many([('/foo/{ext/', {'data': 'x'})])
+
+
+def test_add_many_copies_payloads(routes):
+    payload = {'data': 'x'}
+    routes.add_many([('/foo', payload), ('/bar/{id}', payload)])
+    payload['data'] = 'y'
+    assert routes.match('/foo') == ({'data': 'x'}, {})
+    assert routes.match('/bar/1') == ({'data': 'x'}, {'id': '1'})
+
+
+def test_batch(routes):
+    with routes.batch():
+        routes.add('/foo/{path:[abc]}', something='x')
+        routes.add('/foo/{path:digit}', something='y')
+    assert routes.match('/foo/a') == ({'something': 'x'}, {'path': 'a'})
+    assert routes.match('/foo/12') == ({'something': 'y'}, {'path': '12'})
+
+
+def test_batch_can_be_nested(routes):
+    with routes.batch():
+        routes.add('/foo/{path:[abc]}', something='x')
+        with routes.batch():
+            routes.add('/bar/{path:[abc]}', something='y')
+        # Only published when the outer batch ends.
+        assert routes.match('/bar/b') == (None, None)
+    assert routes.match('/foo/a') == ({'something': 'x'}, {'path': 'a'})
+    assert routes.match('/bar/b') == ({'something': 'y'}, {'path': 'b'})
+
+
+def test_wide_fan_out(routes):
+    for name in ('users', 'boats', 'api', 'éèà', '{id}', 'cars'):
+        routes.add(f'/{name}/', data=name)
+    assert routes.match('/users/') == ({'data': 'users'}, {})
+    assert routes.match('/éèà/') == ({'data': 'éèà'}, {})
+    assert routes.match('/cars/') == ({'data': '{id}'}, {'id': 'cars'})
+    assert routes.match('/boats/') == ({'data': 'boats'}, {})
+    assert routes.match('/planes/') == ({'data': '{id}'}, {'id': 'planes'})
+
+
+def test_match_empty_path(routes):
+    routes.add('foo', data='x')
+    assert routes.match('') == (None, None)
+    routes.add('{path:any}', data='y')
+    assert routes.match('') == ({'data': 'y'}, {'path': ''})
+
+
+def test_static_route_respects_registration_order(routes):
+    routes.add('/foo/{id}', something='x')
+    routes.add('/foo/bar', something='y')
+    routes.add('/bar/baz', something='z')
+    routes.add('/bar/{id}', something='w')
+    assert routes.match('/foo/bar') == ({'something': 'x'}, {'id': 'bar'})
+    assert routes.match('/bar/baz') == ({'something': 'z'}, {})
+    assert routes.match('/bar/qux') == ({'something': 'w'}, {'id': 'qux'})
+
+
+def test_static_route_in_batch(routes):
+    with routes.batch():
+        routes.add('/foo/bar', something='y')
+        routes.add('/foo/{id}', something='x')
+    assert routes.match('/foo/bar') == ({'something': 'y'}, {})
+    routes.add('/foo/bar', other='z')
+    assert routes.match('/foo/bar') == ({'something': 'y', 'other': 'z'}, {})
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_static_route_agrees_with_tree_after_later_adds(routes, batch):
+    def add_all():
+        routes.add('/{v}/b', data='vb')
+        routes.add('/a', data='a')
+        routes.add('/{v}', data='v')
+        routes.add('/users/{id:digit}/x', data='x')
+        routes.add('/users/a', data='ua')
+        routes.add('/{v}/{w}', data='vw')
+    if batch:
+        with routes.batch():
+            add_all()
+    else:
+        add_all()
+    frozen = routes.freeze()
+    for path in ('/a', '/b', '/users/a', '/a/b', '/users/12/x'):
+        expected = frozen.match(path)
+        assert routes.match(path) == expected
+        assert routes.match_bytes(path.encode()) == expected
+        assert routes.match_bytes(bytearray(path.encode())) == expected
+        assert routes.match_normalized(path + '?x=1')[:2] == expected
+    assert routes.match('/a') == ({'data': 'v'}, {'v': 'a'})
+
+
+def test_static_route_match_returns_fresh_params(routes):
+    routes.add('/foo', something='x')
+    payload, params = routes.match('/foo')
+    params['id'] = 'x'
+    assert routes.match('/foo') == ({'something': 'x'}, {})
+
+
+def test_match_cache():
+    routes = Routes(cache_size=2)
+    routes.add('/foo/{id}', something='x')
+    assert routes.match('/foo/bar') == ({'something': 'x'}, {'id': 'bar'})
+    assert routes.match('/foo/bar') == ({'something': 'x'}, {'id': 'bar'})
+    assert routes.match('/bar') == (None, None)
+    assert routes.match('/bar') == (None, None)
+    assert routes.cache_info() == {
+        'hits': 2, 'misses': 2, 'evictions': 0, 'size': 2, 'max_size': 2}
+
+
+def test_match_cache_evicts_least_recently_used():
+    routes = Routes(cache_size=2)
+    routes.add('/foo/{id}', something='x')
+    routes.match('/foo/a')
+    routes.match('/foo/b')
+    routes.match('/foo/a')
+    routes.match('/foo/c')  # Evicts /foo/b.
+    routes.match('/foo/a')
+    assert routes.cache_info()['hits'] == 2
+    assert routes.cache_info()['evictions'] == 1
+    routes.match('/foo/b')
+    assert routes.cache_info()['misses'] == 4
+
+
+def test_match_cache_is_invalidated_on_add():
+    routes = Routes(cache_size=10)
+    routes.add('/foo/{id}', something='x')
+    assert routes.match('/foo/bar') == ({'something': 'x'}, {'id': 'bar'})
+    routes.add('/foo/bar', something='y')
+    assert routes.cache_info()['size'] == 0
+    routes.add('/bar', something='z')
+    assert routes.match('/bar') == ({'something': 'z'}, {})
+
+
+def test_match_cache_returns_fresh_params():
+    routes = Routes(cache_size=10)
+    routes.add('/foo/{id}', something='x')
+    routes.match('/foo/bar')[1]['id'] = 'baz'
+    assert routes.match('/foo/bar') == ({'something': 'x'}, {'id': 'bar'})
+    routes.match('/foo/bar')[1]['id'] = 'baz'
+    assert routes.match('/foo/bar') == ({'something': 'x'}, {'id': 'bar'})
+
+
+def test_placeholder_after_prefix_does_not_match_empty_string(routes):
+    routes.add('/foo.{ext}', data='x')
+    assert routes.match('/foo.') == (None, None)
+
+
+def test_match_deep_path_with_prefixes_and_suffixes(routes):
+    routes.add('/api/v1/{org}/repos/{repo}/tree/{ref:alnum}/{path:path}',
+               data='x')
+    assert routes.match('/api/v1/pyrates/repos/autoroutes/tree/main/a/b') \
+        == ({'data': 'x'}, {'org': 'pyrates', 'repo': 'autoroutes',
+                            'ref': 'main', 'path': 'a/b'})
+    assert routes.match('/api/v1/pyrates/repos/autoroutes/blob/main/a/b') \
+        == (None, None)
+
+
+@pytest.mark.parametrize('path', [
+    '/foo', '/foo/bar', '/foo/22/bar', '/foo/22.json', '/éèà/àéè',
+    '/alpha/àéè', '/alpha/à.è', '/digit/123', '/digit/12a', '/regex/b',
+    '/regex/12', '/regex/abc', '/any/', '/any/a/b', '/nowhere', '',
+    '/int/12', '/float/1.5', '/uuid/12345678-1234-5678-9abc-def012345678',
+])
+def test_match_bytes(routes, path):
+    routes.add('/foo', data='static')
+    routes.add('/foo/{id}/bar', data='middle')
+    routes.add('/foo/{id}.json', data='suffix')
+    routes.add('/éèà/{name}', data='unicode')
+    routes.add('/alpha/{name:alpha}', data='alpha')
+    routes.add('/digit/{id:digit}', data='digit')
+    routes.add('/regex/{id:[abc]}', data='regex')
+    routes.add('/regex/{id:digit}', data='regex digit')
+    routes.add('/any/{path:any}', data='any')
+    routes.add('/int/{id:int}', data='int')
+    routes.add('/float/{ratio:float}', data='float')
+    routes.add('/uuid/{uid:uuid}', data='uuid')
+    assert routes.match_bytes(path.encode()) == routes.match(path)
+    assert routes.match_bytes(bytearray(path.encode())) == routes.match(path)
+    assert routes.match_bytes(memoryview(path.encode())) == routes.match(path)
+
+
+def test_match_bytes_with_invalid_utf8(routes):
+    routes.add('/foo/{id:alnum}', data='x')
+    routes.add('/bar/{id}', data='y')
+    assert routes.match_bytes(b'/foo/\xe9t\xe9') == (None, None)
+    assert routes.match_bytes(b'/bar/\xe9t\xe9') == (
+        {'data': 'y'}, {'id': '\udce9t\udce9'})
+
+
+@pytest.mark.parametrize('path', [
+    '/dot/éèà', '/dot/abc', '/dot/éè', '/dot/ab\udcff', '/class/éé', '/class/ee',
+    '/word/éa1/end', '/\udce9/é\udcff', '//aéa', '//aé',
+])
+def test_match_bytes_with_regex_and_non_ascii(routes, path):
+    routes.add('/dot/{v:.{3}}', data='dot')
+    routes.add('/class/{v:[é]+}', data='class')
+    routes.add(r'/word/{v:\w+}/end', data='word')
+    routes.add('/\udce9/{v:.+}', data='escaped')
+    routes.add('//{v:alpha}é', data='suffix')
+    routes.add('/{v:path}', data='path')
+    expected = routes.match(path)
+    encoded = path.encode('utf-8', 'surrogateescape')
+    assert routes.match_bytes(encoded) == expected
+    assert routes.freeze().match_bytes(encoded) == expected
+    assert routes.match_normalized(encoded, merge_slashes=None,
+                                   trailing_slash=None)[:2] == expected
+
+
+def test_match_bytes_regex_counts_chars(routes):
+    routes.add('/foo/{v:.{3}}', data='x')
+    assert routes.match_bytes('/foo/éèà'.encode()) == ({'data': 'x'}, {'v': 'éèà'})
+    assert routes.match_bytes('/foo/éè'.encode()) == (None, None)
+
+
+def test_add_rejects_path_not_encodable_in_utf8(routes):
+    with pytest.raises(InvalidRoute):
+        routes.add('/\ud800', data='x')
+    with pytest.raises(InvalidRoute):
+        routes.mount('/\ud800', Routes())
+    routes.add('/\udce9', data='y')  # Stands for the undecodable byte.
+    assert routes.match_bytes(b'/\xe9') == ({'data': 'y'}, {})
+    assert routes.match('/\ud800') == (None, None)
+
+
+def test_match_bytes_rejects_str(routes):
+    with pytest.raises(TypeError):
+        routes.match_bytes('/foo')
+
+
+def test_match_many(routes):
+    routes.add('/foo/{id}', data='x')
+    routes.add('/bar', data='y')
+    assert routes.match_many(['/foo/1', '/bar', '/baz']) == [
+        ({'data': 'x'}, {'id': '1'}), ({'data': 'y'}, {}), (None, None)]
+    assert routes.match_many(iter(['/foo/1', '/bar'])) == [
+        ({'data': 'x'}, {'id': '1'}), ({'data': 'y'}, {})]
+    assert routes.match_many([]) == []
+
+
+def test_match_many_indices(routes):
+    routes.add('/foo/{id}', data='x')
+    routes.add('/bar', data='y')
+    routes.add('/foo/{id}', other='z')
+    routes.add('/foo/{id}/baz', data='z')
+    assert routes.match_many(['/foo/1', '/bar', '/baz', '/foo/1/baz'],
+                             indices=True) == [0, 1, -1, 2]
+
+
+def test_add_returns_route_id(routes):
+    assert routes.add('/foo/{id}', data='x') == 0
+    assert routes.add('/bar', data='y') == 1
+    assert routes.add('/foo/{id}', other='z') == 0
+    assert routes.add_named('baz', '/baz/{id}') == 2
+
+
+def test_match_values(routes):
+    foo = routes.add('/foo/{id}/bar/{sub:digit}', data='x')
+    bar = routes.add('/bar', data='y')
+    assert routes.match_values('/foo/22/bar/33') == (foo, ('22', '33'))
+    assert routes.match_values('/bar') == (bar, ())
+    assert routes.match_values('/foo/22/bar/baz') == (-1, None)
+    assert routes.match_values('/baz') == (-1, None)
+
+
+def test_match_values_after_remove(routes):
+    routes.add('/foo/{id}', data='x')
+    bar = routes.add('/bar/{id}', data='y')
+    routes.remove('/foo/{id}')
+    assert routes.match_values('/bar/22') == (bar, ('22',))
+    assert routes.match_values('/foo/22') == (-1, None)
+
+
+@pytest.mark.parametrize('path,expected', [
+    ['/foo/', ({'data': 'foo'}, {}, None)],
+    ['/foo/?page=2', ({'data': 'foo'}, {}, None)],
+    ['/foo', ({'data': 'foo'}, {}, '/foo/')],
+    ['/foo?page=2', ({'data': 'foo'}, {}, '/foo/?page=2')],
+    ['/foo/22', ({'data': 'id'}, {'id': '22'}, None)],
+    ['/foo/22/', ({'data': 'id'}, {'id': '22'}, '/foo/22')],
+    ['//foo///22?a=/b//c', ({'data': 'id'}, {'id': '22'}, '/foo/22?a=/b//c')],
+    ['/bar/', ({'data': 'bar'}, {}, '/bar')],
+    ['', ({'data': 'root'}, {}, '/')],
+    ['/baz', (None, None, None)],
+    ['/baz?foo', (None, None, None)],
+])
+def test_match_normalized(routes, path, expected):
+    routes.add('/', data='root')
+    routes.add('/foo/', data='foo')
+    routes.add('/foo/{id}', data='id')
+    routes.add('/bar', data='bar')
+    assert routes.match_normalized(path) == expected
+    payload, params, redirect = expected
+    assert routes.match_normalized(path.encode()) == (
+        payload, params, redirect.encode() if redirect else None)
+
+
+def test_match_normalized_modes(routes):
+    routes.add('/foo/', GET='get')
+    routes.add('/bar/{id}', data='bar')
+    assert routes.match_normalized('/foo', 'GET') == ('get', {}, '/foo/')
+    assert routes.match_normalized('/foo', trailing_slash='ignore') == ({'GET': 'get'}, {}, None)
+    assert routes.match_normalized('/foo', trailing_slash=None) == (None, None, None)
+    assert routes.match_normalized('/bar//1', merge_slashes='ignore') == (
+        {'data': 'bar'}, {'id': '1'}, None)
+    assert routes.match_normalized('/bar//1', merge_slashes=None) == (None, None, None)
+    assert routes.match_normalized('/foo/?a', strip_query=False) == (None, None, None)
+    assert routes.match_normalized(bytearray(b'/foo')) == ({'GET': 'get'}, {}, b'/foo/')
+    with pytest.raises(ValueError):
+        routes.match_normalized('/foo', trailing_slash='add')
+
+
+def test_match_many_only_accepts_str(routes):
+    with pytest.raises(TypeError):
+        routes.match_many([b'/foo'])
+
+
+def test_regex_with_prefix_and_suffix(routes):
+    routes.add(r'/foo/{id:\d+}.json', data='json')
+    routes.add(r'/foo/{id:[a-z]+}.json', data='alpha')
+    routes.add(r'/foo/{id:\d+}.xml', data='xml')
+    assert routes.match('/foo/12.json') == ({'data': 'json'}, {'id': '12'})
+    assert routes.match('/foo/ab.json') == ({'data': 'alpha'}, {'id': 'ab'})
+    assert routes.match('/foo/12.xml') == ({'data': 'xml'}, {'id': '12'})
+    assert routes.match('/foo/12.csv') == (None, None)
+
+
+def test_regex_route_can_be_updated(routes):
+    routes.add(r'/foo/{id:\d+}', data='old')
+    routes.add(r'/foo/{id:\d+}', data='new', other='new')
+    assert routes.match('/foo/12') == ({'data': 'new', 'other': 'new'},
+                                       {'id': '12'})
+
+
+def test_regex_does_not_slow_down_siblings(routes):
+    routes.add('/foo/me', data='me')
+    routes.add(r'/foo/{id:[0-9a-f]+}', data='id')
+    routes.add('/foo/{name}/profile', data='profile')
+    assert routes.match('/foo/me') == ({'data': 'me'}, {})
+    assert routes.match('/foo/12ab') == ({'data': 'id'}, {'id': '12ab'})
+    assert routes.match('/foo/john/profile') == ({'data': 'profile'},
+                                                 {'name': 'john'})
+    assert routes.match('/foo/12ab/profile') == ({'data': 'profile'},
+                                                 {'name': '12ab'})
+
+
+def test_regex_with_braces_does_not_shadow_siblings(routes):
+    routes.add('/foo/{id:[0-9a-f]{24}}', data='id')
+    routes.add('/foo/{name}', data='name')
+    assert routes.match('/foo/bar') == ({'data': 'name'}, {'name': 'bar'})
+
+
+def test_url_for_with_unclosed_placeholder(routes):
+    routes.add_named('x', '/a}{b', data='x')
+    routes.add_named('y', '/{id}/a}{b', data='y')
+    assert routes.url_for('x') == '/a}{b'
+    assert routes.url_for('y', id=1) == '/1/a}{b'
+    assert routes.match('/a}{b') == ({'data': 'x'}, {})
+
+
+def test_regex_with_curly_braces(routes):
+    routes.add('/foo/{id:[0-9a-f]{24}}', data='id')
+    routes.add('/foo/{name}', data='name')
+    routes.add_named('bar', '/bar/{a:[a-z]{2}}/{b:[0-9]{1,3}}.json', data='bar')
+    object_id = '5f2b' * 6
+    assert routes.match(f'/foo/{object_id}') == ({'data': 'id'}, {'id': object_id})
+    assert routes.match('/foo/bar') == ({'data': 'name'}, {'name': 'bar'})
+    assert routes.match('/bar/ab/123.json') == ({'data': 'bar'}, {'a': 'ab', 'b': '123'})
+    assert routes.freeze().match(f'/foo/{object_id}') == ({'data': 'id'}, {'id': object_id})
+    assert routes.url_for('bar', a='cd', b=4) == '/bar/cd/4.json'
+    with pytest.raises(ValueError):
+        routes.url_for('bar', a='abc', b=4)
+
+
+def handler():
+    pass
+
+
+def test_dump_and_load_bytes(routes):
+    routes.add('/foo', data='static')
+    routes.add('/foo/{id}/bar', data='middle')
+    routes.add(r'/foo/{id:\d+}.json', handler=handler)
+    routes.add('/foo/{id:alpha}', data='alpha')
+    loaded = Routes.load_bytes(routes.dump_bytes())
+    for path in ('/foo', '/foo/22/bar', '/foo/22.json', '/foo/abc',
+                 '/foo/a.json', '/bar'):
+        assert loaded.match(path) == routes.match(path)
+        assert loaded.match_bytes(path.encode()) == routes.match(path)
+    loaded.add('/foo/{id}/baz', data='new')
+    assert loaded.match('/foo/22/baz') == ({'data': 'new'}, {'id': '22'})
+    assert loaded.match_many(['/foo/22/baz'], indices=True) == [4]
+    assert routes.match('/foo/22/baz') == (None, None)
+
+
+def test_load_bytes_rejects_other_objects():
+    with pytest.raises(TypeError):
+        Routes.load_bytes(pickle.dumps({}))
+
+
+def test_pickle_keeps_cache_size():
+    routes = Routes(cache_size=10)
+    routes.add('/foo/{id}', data='x')
+    routes.match('/foo/bar')
+    loaded = pickle.loads(pickle.dumps(routes))
+    assert loaded.match('/foo/bar') == ({'data': 'x'}, {'id': 'bar'})
+    assert loaded.cache_info() == {
+        'hits': 0, 'misses': 1, 'evictions': 0, 'size': 1, 'max_size': 10}
+
+
+def test_match_method(routes):
+    routes.add('/foo/{id}', GET='get', POST='post')
+    routes.add('/foo/{id}', DELETE='delete')
+    routes.add('/bar', GET='get bar', PROPFIND='propfind')
+    assert routes.match('/foo/22', method='GET') == ('get', {'id': '22'})
+    assert routes.match('/foo/22', method='DELETE') == ('delete', {'id': '22'})
+    assert routes.match('/bar', method='GET') == ('get bar', {})
+    assert routes.match('/bar', method='PROPFIND') == ('propfind', {})
+    assert routes.match('/foo/22') == (
+        {'GET': 'get', 'POST': 'post', 'DELETE': 'delete'}, {'id': '22'})
+
+
+def test_match_method_tells_405_from_404(routes):
+    routes.add('/foo/{id}', GET='get')
+    routes.add('/bar', GET='get bar')
+    # Method not allowed: no payload value, but params.
+    assert routes.match('/foo/22', method='PUT') == (None, {'id': '22'})
+    assert routes.match('/bar', method='MKCOL') == (None, {})
+    # Not found.
+    assert routes.match('/baz', method='GET') == (None, None)
+
+
+def test_match_bytes_method(routes):
+    routes.add('/foo/{id}', GET='get')
+    routes.add('/bar', POST='post')
+    assert routes.match_bytes(b'/foo/22', method='GET') == ('get', {'id': '22'})
+    assert routes.match_bytes(b'/bar', method='POST') == ('post', {})
+    assert routes.match_bytes(b'/bar', method='GET') == (None, {})
+    assert routes.match_bytes(b'/baz', method='GET') == (None, None)
+
+
+def test_match_method_with_cache():
+    routes = Routes(cache_size=10)
+    routes.add('/foo/{id}', GET='get', POST='post')
+    assert routes.match('/foo/22', method='GET') == ('get', {'id': '22'})
+    assert routes.match('/foo/22', method='POST') == ('post', {'id': '22'})
+    assert routes.match('/foo/22', method='PUT') == (None, {'id': '22'})
+    assert routes.match('/foo/22') == ({'GET': 'get', 'POST': 'post'}, {'id': '22'})
+    assert routes.cache_info()['hits'] == 3
+
+
+def test_match_method_after_load_bytes(routes):
+    routes.add('/foo/{id}', GET='get')
+    loaded = Routes.load_bytes(routes.dump_bytes())
+    assert loaded.match('/foo/22', method='GET') == ('get', {'id': '22'})
+    assert loaded.match('/foo/22', method='POST') == (None, {'id': '22'})
+
+
+@pytest.mark.parametrize('path,params,expected', [
+    ('/foo', {}, '/foo'),
+    ('/foo/{id}', {'id': 'bar'}, '/foo/bar'),
+    ('/foo/{id:digit}/bar', {'id': 22}, '/foo/22/bar'),
+    ('/foo/{id}.json', {'id': 'bar'}, '/foo/bar.json'),
+    ('/foo/{id:alpha}/{sub:path}', {'id': 'bar', 'sub': 'baz/qux'}, '/foo/bar/baz/qux'),
+    ('/foo/{id:any}', {'id': ''}, '/foo/'),
+    (r'/foo/{id:[abc]\d}', {'id': 'a2'}, '/foo/a2'),
+    ('/éèà/{name}', {'name': 'ù'}, '/éèà/ù'),
+    ('/foo/{name}/{name}', {'name': 'bar'}, '/foo/bar/bar'),
+    ('/foo/{id:int}', {'id': 22}, '/foo/22'),
+    ('/foo/{ratio:float}', {'ratio': 1.5}, '/foo/1.5'),
+    ('/foo/{uid:uuid}', {'uid': uuid.UUID(int=1)}, '/foo/00000000-0000-0000-0000-000000000001'),
+])
+def test_url_for(routes, path, params, expected):
+    routes.add_named('route', path, data='x')
+    assert routes.url_for('route', **params) == expected
+    assert routes.match(expected)[0] == {'data': 'x'}
+
+
+@pytest.mark.parametrize('path,params', [
+    ('/foo/{id}', {'id': 'bar/baz'}),
+    ('/foo/{id}', {'id': ''}),
+    ('/foo/{id:digit}', {'id': '22a'}),
+    ('/foo/{id:alpha}', {'id': 22}),
+    ('/foo/{id:int}', {'id': -1}),
+    ('/foo/{ratio:float}', {'ratio': 1e20}),
+    ('/foo/{id:alnum}', {'id': 'bar-baz'}),
+    ('/foo/{id:[abc]}', {'id': 'ab'}),
+    ('/foo/{id}', {}),
+    ('/foo/{id}', {'id': 'bar', 'other': 'baz'}),
+])
+def test_url_for_validates_params(routes, path, params):
+    routes.add_named('route', path, data='x')
+    with pytest.raises(ValueError):
+        routes.url_for('route', **params)
+
+
+def test_url_for_unknown_name(routes):
+    routes.add('/foo/{id}', data='x')
+    with pytest.raises(KeyError):
+        routes.url_for('foo', id='bar')
+
+
+def test_url_for_accepts_name_and_path_params(routes):
+    routes.add_named('route', '/foo/{name}/{path}', data='x')
+    assert routes.url_for('route', name='bar', path='baz') == '/foo/bar/baz'
+
+
+def test_add_named_validates_route(routes):
+    with pytest.raises(InvalidRoute):
+        routes.add_named('route', '/foo/{id', data='x')
+    with pytest.raises(KeyError):
+        routes.url_for('route', id='bar')
+
+
+def test_url_for_after_load_bytes(routes):
+    routes.add_named('route', '/foo/{id:digit}', data='x')
+    loaded = Routes.load_bytes(routes.dump_bytes())
+    assert loaded.url_for('route', id=22) == '/foo/22'
+
+
+def test_remove(routes):
+    routes.add('/foo', data='static')
+    routes.add('/foo/{id}', data='placeholder')
+    routes.add('/foo/{id}/bar', data='middle')
+    routes.add('/foo/{id:digit}.json', data='suffix')
+    routes.remove('/foo/{id}')
+    assert routes.match('/foo/22') == (None, None)
+    assert routes.match('/foo') == ({'data': 'static'}, {})
+    assert routes.match('/foo/22/bar') == ({'data': 'middle'}, {'id': '22'})
+    assert routes.match('/foo/22.json') == ({'data': 'suffix'}, {'id': '22'})
+    routes.remove('/foo')
+    assert routes.match('/foo') == (None, None)
+    assert routes.match_bytes(b'/foo') == (None, None)
+    routes.remove('/foo/{id:digit}.json')
+    routes.remove('/foo/{id}/bar')
+    assert routes.match('/foo/22/bar') == (None, None)
+    assert not routes.root.edges
+
+
+def test_remove_unknown_route(routes):
+    routes.add('/foo/{id}/bar', data='x')
+    for path in ('/foo', '/foo/{id}', '/foo/{id}/ba', '/foo/{id}/bar/baz', '/bar'):
+        with pytest.raises(KeyError):
+            routes.remove(path)
+    assert routes.match('/foo/22/bar') == ({'data': 'x'}, {'id': '22'})
+
+
+@pytest.mark.parametrize('siblings', [(), ('/foo/bar', '/foo/{name}', r'/foo/{id:\d+}/x/{y}')])
+@pytest.mark.parametrize('path', [r'/foo/{id:\d+}', '/{r:[a-c]+}'])
+def test_remove_regex_route_with_prefix(path, siblings):
+    for replace in (False, True):
+        routes = Routes()
+        for sibling in siblings:
+            routes.add(sibling, data=sibling)
+        routes.add(path, data='regex')
+        with pytest.raises(KeyError):
+            routes.remove(path.replace('+', '*'))
+        with pytest.raises(KeyError):
+            routes.replace(remove=[path.replace('+', '*')])
+        if replace:
+            routes.replace(remove=[path])
+        else:
+            routes.remove(path)
+        assert routes.match('/foo/12')[0] in (None, {'data': '/foo/{name}'})
+        assert routes.match('/ab') == (None, None)
+        for sibling in siblings:
+            assert routes.match(sibling.replace(r'{id:\d+}', '1').replace('{y}', '2')
+                                .replace('{name}', 'n'))[0] == {'data': sibling}
+        with pytest.raises(KeyError):
+            routes.remove(path)
+
+
+def test_remove_then_add_again(routes):
+    routes.add('/foo/{id}', data='x')
+    routes.remove('/foo/{id}')
+    routes.add('/foo/{id}', other='y')
+    assert routes.match('/foo/22') == ({'other': 'y'}, {'id': '22'})
+    assert routes.match_many(['/foo/22'], indices=True) == [1]
+
+
+def test_remove_named_route(routes):
+    routes.add_named('foo', '/foo/{id}', data='x')
+    routes.remove('/foo/{id}')
+    with pytest.raises(KeyError):
+        routes.url_for('foo', id='bar')
+
+
+def test_remove_in_batch(routes):
+    routes.add('/foo', data='x')
+    with routes.batch():
+        routes.add('/bar', data='y')
+        routes.remove('/bar')
+        routes.remove('/foo')
+    assert routes.match('/foo') == (None, None)
+    assert routes.match('/bar') == (None, None)
+
+
+def test_remove_then_freeze(routes):
+    routes.add('/foo/{id}', GET='foo')
+    routes.add('/bar/{id}', GET='bar')
+    routes.remove('/foo/{id}')
+    frozen = routes.freeze()
+    assert frozen.match('/bar/22', method='GET') == ('bar', {'id': '22'})
+    assert frozen.match('/foo/22') == (None, None)
+
+
+def test_remove_clears_the_cache():
+    routes = Routes(cache_size=10)
+    routes.add('/foo/{id}', data='x')
+    assert routes.match('/foo/22') == ({'data': 'x'}, {'id': '22'})
+    routes.remove('/foo/{id}')
+    assert routes.match('/foo/22') == (None, None)
+
+
+def test_replace(routes):
+    routes.add('/foo', data='static')
+    routes.add('/foo/{id}', data='placeholder', other='x')
+    routes.add('/bar/{id}', data='bar')
+    routes.replace([('/foo/{id}', {'data': 'new'}), ('/baz', {'data': 'baz'})],
+                   remove=['/bar/{id}'])
+    assert routes.match('/foo') == ({'data': 'static'}, {})
+    assert routes.match('/foo/22') == ({'data': 'new'}, {'id': '22'})
+    assert routes.match('/baz') == ({'data': 'baz'}, {})
+    assert routes.match_bytes(b'/baz') == ({'data': 'baz'}, {})
+    assert routes.match('/bar/22') == (None, None)
+
+
+def test_replace_keeps_static_routes_up_to_date(routes):
+    routes.add('/foo', data='x')
+    routes.replace([('/foo/bar', {'data': 'y'})])
+    routes.replace([('/foo', {'data': 'z'})])
+    assert routes.match('/foo') == ({'data': 'z'}, {})
+    assert routes.match_bytes(b'/foo') == ({'data': 'z'}, {})
+    routes.replace(remove=['/foo'])
+    assert routes.match('/foo') == (None, None)
+    assert routes.match('/foo/bar') == ({'data': 'y'}, {})
+
+
+def test_replace_is_atomic(routes):
+    routes.add('/foo/{id}', data='x')
+    routes.add_named('bar', '/bar', data='y')
+    root = routes.root
+    with pytest.raises(KeyError):
+        routes.replace([('/baz', {'data': 'z'})], remove=['/bar', '/unknown'])
+    with pytest.raises(InvalidRoute):
+        routes.replace([('/baz', {'data': 'z'}), ('/qux/{id', {})])
+    assert routes.root is root
+    assert routes.match('/bar') == ({'data': 'y'}, {})
+    assert routes.match('/baz') == (None, None)
+    assert routes.url_for('bar') == '/bar'
+    assert routes.match_many(['/foo/1', '/bar'], indices=True) == [0, 1]
+
+
+def test_replace_does_not_change_previous_results(routes):
+    routes.add('/foo/{id}', data='x')
+    payload, _ = routes.match('/foo/22')
+    routes.replace([('/foo/{id}', {'data': 'y'})])
+    assert payload == {'data': 'x'}
+    assert routes.match('/foo/22') == ({'data': 'y'}, {'id': '22'})
+
+
+def test_mount(routes):
+    blog = Routes()
+    blog.add('/', data='index')
+    blog.add('/{slug}', data='post')
+    routes.add('/', data='home')
+    routes.mount('/blog', blog)
+    routes.add('/about', data='about')
+    assert routes.match('/blog/') == ({'data': 'index'}, {})
+    assert routes.match('/blog/hello') == ({'data': 'post'}, {'slug': 'hello'})
+    assert routes.match_bytes(b'/blog/hello') == ({'data': 'post'}, {'slug': 'hello'})
+    assert routes.match_values('/blog/hello') == ((1, 1), ('hello',))  # Mount, then blog.
+    assert routes.match('/about') == ({'data': 'about'}, {})
+    assert routes.match('/') == ({'data': 'home'}, {})
+    for path in ('/blog', '/blogs/', '/blog/hello/world'):
+        assert routes.match(path) == (None, None)
+
+
+def test_mount_sees_changes_of_mounted_routes():
+    routes = Routes(cache_size=10)
+    blog = Routes()
+    blog.add('/{slug}', data='post')
+    routes.mount('/blog', blog)
+    assert routes.match('/blog/hello') == ({'data': 'post'}, {'slug': 'hello'})
+    blog.add('/{year:int}/{slug}', data='dated')
+    blog.remove('/{slug}')
+    assert routes.match('/blog/hello') == (None, None)  # Not from the cache.
+    assert routes.match('/blog/2024/hello') == ({'data': 'dated'},
+                                                {'year': 2024, 'slug': 'hello'})
+    other = Routes()
+    other.add('/{slug}', data='other')
+    routes.mount('/blog', other)
+    assert routes.match('/blog/hello') == ({'data': 'other'}, {'slug': 'hello'})
+
+
+def test_mount_respects_registration_order(routes):
+    blog = Routes()
+    blog.add('/{slug}', data='post')
+    routes.add('/{path:path}', data='catch all')
+    routes.mount('/blog', blog)
+    assert routes.match('/blog/hello') == ({'data': 'catch all'}, {'path': 'blog/hello'})
+    routes.remove('/{path:path}')
+    routes.add('/{path:path}', data='catch all')
+    assert routes.match('/blog/hello') == ({'data': 'post'}, {'slug': 'hello'})
+
+
+def test_mount_nested(routes):
+    blog, admin = Routes(), Routes()
+    admin.add('/{id:digit}', data='admin')
+    blog.mount('/admin', admin)
+    routes.mount('/blog', blog)
+    assert routes.match('/blog/admin/12') == ({'data': 'admin'}, {'id': '12'})
+    with pytest.raises(ValueError):
+        admin.mount('/root', routes)
+    with pytest.raises(ValueError):
+        routes.mount('/self', routes)
+
+
+def test_mount_conflicts(routes):
+    routes.add('/foo/bar', data='x')
+    routes.mount('/blog', Routes())
+    for prefix in ('', '/{id}', '/foo', '/foo/bar'):
+        with pytest.raises(InvalidRoute):
+            routes.mount(prefix, Routes())
+    for path in ('/blog', '/blog/{id}'):
+        with pytest.raises(InvalidRoute):
+            routes.add(path, data='y')
+    assert routes.match('/foo/bar') == ({'data': 'x'}, {})
+
+
+def test_unmount(routes):
+    blog = Routes()
+    blog.add('/{slug}', data='post')
+    routes.add('/blog', data='x')
+    routes.mount('/blog/', blog)
+    with pytest.raises(KeyError):
+        routes.unmount('/blog')
+    with pytest.raises(KeyError):
+        routes.remove('/blog/')
+    routes.unmount('/blog/')
+    assert routes.match('/blog/hello') == (None, None)
+    assert routes.match('/blog') == ({'data': 'x'}, {})
+    routes.add('/blog/{id}', data='y')
+    assert routes.match('/blog/hello') == ({'data': 'y'}, {'id': 'hello'})
+
+
+def test_mount_route_ids_do_not_collide():
+    samples = []
+    routes = Routes(sampler=lambda path, route_id, duration: samples.append(route_id),
+                    sample_every=1)
+    blog, admin = Routes(), Routes()
+    admin.add('/{id:digit}', data='admin')
+    blog.add('/', data='index')
+    blog.mount('/admin', admin)
+    assert routes.add('/', data='home') == 0
+    routes.mount('/blog', blog)
+    assert routes.add('/about', data='about') == 2
+    paths = ['/', '/blog/', '/blog/admin/12', '/about', '/nowhere']
+    ids = [0, (1, 0), (1, 1, 0), 2, -1]
+    assert [routes.match_values(path)[0] for path in paths] == ids
+    assert routes.match_many(paths, indices=True) == ids
+    del samples[:]
+    for path in paths:
+        routes.match(path)
+        routes.match_bytes(path.encode())
+        routes.match_normalized(path + '?page=2')
+    assert samples == [id for id in ids for _ in range(3)]
+
+
+def test_unmount_releases_mounted_routes():
+    routes = Routes(cache_size=10)
+    blog = Routes()
+    blog.add('/{slug}', data='post')
+    routes.mount('/blog', blog)
+    routes.mount('/news', blog)
+    routes.unmount('/news')
+    routes.match('/blog/hello')
+    blog.add('/{year:int}/{slug}', data='dated')  # Still mounted at /blog.
+    assert routes.cache_info()['size'] == 0
+    routes.unmount('/blog')
+    routes.match('/blog/hello')
+    blog.remove('/{slug}')  # No longer mounted.
+    assert routes.cache_info()['size'] == 1
+    assert routes.match('/blog/hello') == (None, None)
+    assert blog.match('/2024/hello') == ({'data': 'dated'}, {'year': 2024, 'slug': 'hello'})
+
+
+def test_mount_pickle(routes):
+    blog = Routes()
+    blog.add('/{slug}', data='post')
+    routes.mount('/blog', blog)
+    loaded = pickle.loads(pickle.dumps(routes))
+    assert loaded.match('/blog/hello') == ({'data': 'post'}, {'slug': 'hello'})
+    assert loaded.match_values('/blog/hello') == ((0, 0), ('hello',))
+    with pytest.raises(ValueError):
+        routes.freeze()
+
+
+def test_stats():
+    routes = Routes(stats=True)
+    routes.add('/foo', data='x')
+    routes.add('/foo/{id}', data='y')
+    routes.add(r'/bar/{id:\d+}', data='z')
+    routes.add('/bar/baz/{id}', data='w')
+    for path in ('/foo', '/foo/1', '/foo/2', '/bar/12', '/bar/baz/1', '/nowhere',
+                 '/bar/ab'):
+        routes.match(path)
+    assert routes.stats() == {
+        'hits': {'/foo': 1, '/foo/{id}': 2, r'/bar/{id:\d+}': 1, '/bar/baz/{id}': 1},
+        'misses': {'/': 1, '/bar/': 1},
+        'regex': {r'/bar/{id:\d+}': 3},
+    }
+
+
+def test_stats_count_all_match_methods():
+    routes = Routes(stats=True, cache_size=10)
+    routes.add('/foo', data='x')
+    routes.add('/foo/{id}', data='y')
+    routes.match('/foo/1')
+    routes.match('/foo/1')  # From the cache.
+    routes.match_bytes(b'/foo')
+    routes.match_bytes(b'/foo/1')
+    routes.match_values('/foo')
+    routes.match_values('/foo/1')
+    routes.match_many(['/foo', '/foo/1'])
+    routes.match_many(['/foo', '/foo/1'], indices=True)
+    assert routes.stats()['hits'] == {'/foo': 4, '/foo/{id}': 6}
+
+
+def test_stats_are_off_by_default(routes):
+    routes.add('/foo/{id}', data='x')
+    routes.match('/foo/1')
+    routes.match('/bar')
+    assert routes.stats() == {'hits': {'/foo/{id}': 0}, 'misses': {}, 'regex': {}}
+
+
+def test_stats_survive_changes():
+    routes = Routes(stats=True)
+    routes.add('/foo/{id}', data='x')
+    routes.add('/bar/{id}', data='y')
+    routes.match('/foo/1')
+    routes.add('/foo/{id}/baz', data='z')
+    routes.remove('/bar/{id}')
+    routes.match('/foo/1')
+    assert routes.stats()['hits'] == {'/foo/{id}': 2, '/foo/{id}/baz': 0}
+
+
+def test_reset_stats():
+    routes = Routes(stats=True)
+    routes.add('/foo/{id}', data='x')
+    routes.match('/foo/1')
+    routes.match('/bar')
+    routes.reset_stats()
+    assert routes.stats() == {'hits': {'/foo/{id}': 0}, 'misses': {}, 'regex': {}}
+
+
+def test_memory_usage(routes):
+    assert routes.memory_usage()['routes'] == 0
+    routes.add('/foo/{id}', data='x')
+    routes.add('/foo/{id}/bar', data='y')
+    routes.add('/bar/{id}/bar', data='z')
+    usage = routes.memory_usage()
+    assert (usage['routes'], usage['nodes'], usage['edges']) == (3, 5, 4)
+    assert all(size > 0 for size in usage['bytes'].values())
+    assert usage['bytes']['total'] == sum(size for key, size in usage['bytes'].items()
+                                          if key != 'total')
+    routes.remove('/foo/{id}/bar')
+    assert routes.memory_usage()['bytes']['total'] < usage['bytes']['total']
+
+
+def test_slugs_are_shared_per_routes(routes):
+    def slugs(routes):
+        nodes, found = [routes.root], []
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(edge.child for edge in node.edges or ())
+            if node.slugs:
+                found.append(node.slugs)
+        return found
+
+    routes.add('/foo/{id}', data='x')
+    routes.add('/bar/{id:digit}', data='y')
+    other = Routes()
+    other.add('/baz/{id}', data='z')
+    first, second = slugs(routes)
+    assert first == second == ('id',)
+    assert first is second
+    assert slugs(other)[0] is not first
+    loaded = pickle.loads(pickle.dumps(routes))
+    loaded.add('/qux/{id}', data='w')
+    assert len(set(map(id, slugs(loaded)))) == 1
+
+
+def test_sampler():
+    samples = []
+    routes = Routes(sampler=lambda *args: samples.append(args), sample_every=2)
+    routes.add('/foo', data='x')
+    routes.add('/foo/{id}', data='y')
+    for path in ('/foo', '/foo/1', '/bar', '/baz'):
+        routes.match(path)
+    routes.match_bytes(b'/foo')
+    routes.match_values('/foo/2')
+    assert [(path, route_id) for path, route_id, _ in samples] == [
+        ('/foo/1', 1), ('/baz', -1), ('/foo/2', 1)]
+    assert all(isinstance(duration, int) and duration > 0 for *_, duration in samples)
+
+
+def test_pickle_keeps_stats_option():
+    routes = Routes(stats=True)
+    routes.add('/foo/{id}', data='x')
+    loaded = pickle.loads(pickle.dumps(routes))
+    loaded.match('/foo/1')
+    assert loaded.stats()['hits'] == {'/foo/{id}': 1}
+
+
+@pytest.mark.parametrize('path,expected', [
+    ('/é/12345678-1234-5678-9abc-def012345678', 'uuid'),
+    ('/é/12345678-1234-5678-9abc-def012345678/more', None),
+    ('/é/status', 'status'),
+    ('/é/statu', None),
+    ('/é/statuses', None),
+    ('/docs/a/b/c', 'docs'),
+    ('/docs/a/b', None),
+    ('/d', None),
+    ('', None),
+])
+def test_match_with_path_length_bounds(routes, path, expected):
+    routes.add('/é/status', data='status')
+    routes.add('/é/{id:uuid}', data='uuid')
+    routes.add('/docs/{a}/{b}/{c}', data='docs')
+    payload = {'data': expected} if expected else None
+    assert routes.match(path)[0] == payload
+    assert routes.match_bytes(path.encode())[0] == payload
+    assert routes.freeze().match_bytes(path.encode())[0] == payload
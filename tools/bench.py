@@ -1,5 +1,12 @@
+import re
+import string
+import tempfile
+import threading
+import time
+import tracemalloc
 from timeit import timeit
-from autoroutes import Routes
+from uuid import UUID
+from autoroutes import FrozenRoutes, Routes
 
 PATHS = ['user/', 'user/{id}', 'user/{id}/subpath', 'user/{id}/subpath2',
          'boat/', 'boat/{id}', 'boat/{id}/subpath', 'boat/{id}/subpath2',
@@ -28,3 +35,354 @@ print(f'Middle path with placeholder:\n> {total}')
 total = timeit("routes.match('plane/')",
                globals=globals(), number=100000)
 print(f'Not found path:\n> {total}')
+
+total = timeit("routes.match_bytes(b'horse/22/subpath')",
+               globals=globals(), number=100000)
+print(f'Middle path with placeholder (bytes):\n> {total}')
+
+total = timeit("routes.match('horse/22/subpath')[0]['GET']",
+               globals=globals(), number=100000)
+print(f'Middle path with placeholder, then payload lookup:\n> {total}')
+
+total = timeit("routes.match('horse/22/subpath', method='GET')",
+               globals=globals(), number=100000)
+print(f'Middle path with placeholder (method):\n> {total}')
+
+total = timeit("routes.match('horse/22/subpath', method='POST')",
+               globals=globals(), number=100000)
+print(f'Method not allowed:\n> {total}')
+
+total = timeit("routes.match_values('horse/22/subpath')",
+               globals=globals(), number=100000)
+print(f'Middle path with placeholder (values):\n> {total}')
+
+routes.add_named('horse', 'horse/{id}/subpath', GET='horse')
+total = timeit("routes.url_for('horse', id=22)", globals=globals(), number=100000)
+print(f'Build a path with url_for:\n> {total}')
+
+total = timeit("'horse/{id}/subpath'.format(id=22)", globals=globals(), number=100000)
+print(f'Build a path with str.format (no validation):\n> {total}')
+
+many = ['horse/22/subpath', 'user/', 'plane/'] * 100000
+total = timeit("[routes.match(path) for path in many]",
+               globals=globals(), number=1)
+print(f'300k paths, one by one:\n> {total}')
+
+total = timeit("routes.match_many(many)", globals=globals(), number=1)
+print(f'300k paths, match_many:\n> {total}')
+
+total = timeit("routes.match_many(many, indices=True)",
+               globals=globals(), number=1)
+print(f'300k paths, match_many indices:\n> {total}')
+
+cached = Routes(cache_size=100)
+for i, path in enumerate(PATHS):
+    cached.add(path, GET=i)
+total = timeit("cached.match('horse/22/subpath')",
+               globals=globals(), number=100000)
+print(f'Middle path with placeholder (cached):\n> {total}')
+
+counted = Routes(stats=True, sampler=lambda *args: None)
+for i, path in enumerate(PATHS):
+    counted.add(path, GET=i)
+total = timeit("counted.match('horse/22/subpath')",
+               globals=globals(), number=100000)
+print(f'Middle path with placeholder (stats and sampler):\n> {total}')
+
+
+def registration_paths(count):
+    for i in range(count // 4):
+        yield f'resource{i}/'
+        yield f'resource{i}/{{id}}'
+        yield f'resource{i}/{{id}}/subpath'
+        yield f'resource{i}/{{id:digit}}/subpath2'
+
+
+print('Registration:')
+for count in (500, 1000, 2000, 4000):
+    paths = list(registration_paths(count))
+
+    def add():
+        routes = Routes()
+        for path in paths:
+            routes.add(path, GET=path)
+
+    def add_many():
+        Routes().add_many((path, {'GET': path}) for path in paths)
+
+    snapshot = Routes()
+    snapshot.add_many((path, {'GET': path}) for path in paths)
+    snapshot = snapshot.dump_bytes()
+
+    def load_bytes():
+        Routes.load_bytes(snapshot)
+
+    print(f'{count} routes:\n'
+          f'> add: {timeit(add, number=1)}\n'
+          f'> add_many: {timeit(add_many, number=1)}\n'
+          f'> load_bytes: {timeit(load_bytes, number=1)}')
+
+print('Single add on a loaded table:')
+for count in (1000, 4000):
+    routes = Routes()
+    routes.add_many((path, {'GET': path})
+                    for path in registration_paths(count))
+    total = timeit("routes.add('resource0/{id}/other', GET='x')",
+                   globals=globals(), number=100)
+    print(f'{count} routes:\n> {total}')
+
+print('Live update of a loaded table:')
+for count in (1000, 4000):
+    paths = list(registration_paths(count))
+    routes = Routes()
+    routes.add_many((path, {'GET': path}) for path in paths)
+
+    def remove_and_add():
+        routes.remove('resource0/{id}/subpath')
+        routes.add('resource0/{id}/subpath', GET='x')
+
+    def replace():
+        routes.replace([('resource0/{id}/subpath', {'GET': 'x'})],
+                       remove=['resource0/{id:digit}/subpath2'])
+        routes.add('resource0/{id:digit}/subpath2', GET='x')
+
+    def rebuild():
+        Routes().add_many((path, {'GET': path}) for path in paths)
+
+    print(f'{count} routes:\n'
+          f'> remove + add: {timeit(remove_and_add, number=100)}\n'
+          f'> replace + add: {timeit(replace, number=100)}\n'
+          f'> rebuild: {timeit(rebuild, number=100)}')
+
+print('Memory per route (tenant routes):')
+
+
+def tenant_paths(count):
+    for i in range(count // 5):
+        yield f'/tenant{i}/'
+        yield f'/tenant{i}/users/{{id:int}}'
+        yield f'/tenant{i}/users/{{id:int}}/posts/{{slug}}'
+        yield f'/tenant{i}/files/{{name}}.{{ext}}'
+        yield f'/tenant{i}/search/{{query:[a-z]+}}'
+
+
+for count in (10000, 100000):
+    paths = list(tenant_paths(count))
+    tracemalloc.start()
+    routes = Routes()
+    routes.add_many((path, {'GET': path}) for path in paths)
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    usage = routes.memory_usage()
+    print(f'{count} routes:\n'
+          f'> traced: {traced // count} bytes/route\n'
+          f'> memory_usage: {usage["bytes"]["total"] // count} bytes/route')
+del routes, paths
+
+print('Mounted apps (40 apps of 100 routes):')
+mounted, flat = Routes(), Routes()
+apps = []
+for i in range(40):
+    app = Routes()
+    app.add_many((path, {'GET': path}) for path in registration_paths(100))
+    mounted.mount(f'/app{i}/', app)
+    apps.append(app)
+    flat.add_many((f'/app{i}/{path}', {'GET': path}) for path in registration_paths(100))
+
+
+def update_app():
+    apps[-1].remove('resource0/{id}/subpath')
+    apps[-1].add('resource0/{id}/subpath', GET='x')
+
+
+def update_flat():
+    flat.remove('/app39/resource0/{id}/subpath')
+    flat.add('/app39/resource0/{id}/subpath', GET='x')
+
+
+for name, obj in (('Mounted', mounted), ('Flat', flat)):
+    total = timeit("obj.match('/app39/resource24/22/subpath')", globals=globals(),
+                   number=100000)
+    print(f'{name}, path in the last app:\n> {total}')
+print(f'Mounted, update an app:\n> {timeit(update_app, number=100)}')
+print(f'Flat, update an app:\n> {timeit(update_flat, number=100)}')
+
+print('Scanner probes (misses):')
+routes = Routes()
+for i in range(100):
+    routes.add(f'/api/v1/resource{i}/status', GET=i)
+    routes.add(f'/api/v1/resource{i}/{{id:uuid}}', GET=i)
+    routes.add(f'/api/v1/resource{i}/{{id:uuid}}/history/{{version:int}}', GET=i)
+    routes.add(f'/docs/{i}/{{a}}/{{b}}/{{c}}/{{d}}', GET=i)
+PROBES = {
+    'Unknown root': '/wp-admin/install.php',
+    'Unknown root, shorter than any route': '/.env',
+    'Shorter than the routes below': '/docs/5/a/b',
+    'Longer than the routes below': '/api/v1/resource5/status/' + 'x' * 50,
+}
+for name, probe in PROBES.items():
+    total = timeit("routes.match(probe)", globals=globals(), number=100000)
+    print(f'{name}:\n> {total}')
+
+print('Wide fan-out:')
+routes = Routes()
+for char in string.ascii_letters + string.digits:
+    routes.add(f'/{char}resource/', GET=char)
+    routes.add(f'/{char}resource/{{id}}', GET=char)
+
+total = timeit("routes.match('/9resource/22')",
+               globals=globals(), number=100000)
+print(f'Last registered path:\n> {total}')
+
+total = timeit("routes.match('/_resource/22')",
+               globals=globals(), number=100000)
+print(f'Not found path:\n> {total}')
+
+print('Static routes:')
+routes = Routes()
+for i in range(100):
+    routes.add(f'/api/v1/resource{i}/status', GET=i)
+    routes.add(f'/api/v1/resource{i}/{{id}}', GET=i)
+
+total = timeit("routes.match('/api/v1/resource99/status')",
+               globals=globals(), number=100000)
+print(f'Static path:\n> {total}')
+
+print('Match types:')
+VALUES = {  # 60 to 120 chars, where scanning the value dominates.
+    'string': 'some-long-value-for-a-string-placeholder' * 2,
+    'digit': '1234567890' * 6,
+    'alpha': 'somelongvalueforanalphaplaceholder' * 3,
+    'alnum': 'somelongvalue1234forranalnumplaceholder' * 3,
+    'path': 'some/long/value/for/a/path/placeholder' * 2,
+}
+for match_type, value in VALUES.items():
+    routes = Routes()
+    routes.add(f'/foo/{{value:{match_type}}}/bar', GET=match_type)
+    path = f'/foo/{value}/bar'
+    total = timeit('routes.match(path)', globals=globals(), number=200000)
+    print(f'{match_type}:\n> {total}')
+
+print('Converted values:')
+CONVERTED = [
+    ('digit', 'int', '12345678', int),
+    ('string', 'float', '1234.5678', float),
+    ('string', 'uuid', '12345678-1234-5678-9abc-def012345678', UUID),
+]
+for match_type, converter, value, convert in CONVERTED:
+    routes = Routes()
+    routes.add(f'/foo/{{value:{match_type}}}/bar', GET=match_type)
+    routes.add(f'/baz/{{value:{converter}}}/bar', GET=converter)
+    total = timeit(f"convert(routes.match('/foo/{value}/bar')[1]['value'])",
+                   globals=globals(), number=100000)
+    print(f'{match_type}, then {convert.__name__}():\n> {total}')
+    total = timeit(f"routes.match('/baz/{value}/bar')[1]['value']",
+                   globals=globals(), number=100000)
+    print(f'{converter}:\n> {total}')
+
+print('Normalized paths (query string, trailing slash):')
+routes = Routes()
+for i in range(100):
+    routes.add(f'/api/v1/resource{i}/', GET=i)
+    routes.add(f'/api/v1/resource{i}/{{id}}', GET=i)
+
+
+def middleware(path):
+    # What an app would do without match_normalized.
+    path = path.split('?', 1)[0]
+    if '//' in path:
+        path = re.sub('//+', '/', path)
+    payload, params = routes.match(path)
+    if payload is None:
+        path = path[:-1] if path.endswith('/') else path + '/'
+        payload, params = routes.match(path)
+    return payload, params
+
+
+for path in ('/api/v1/resource99/22?page=2', '/api/v1/resource99?page=2',
+             '/api/v1/resource99/22'):
+    total = timeit('middleware(path)', globals=globals(), number=100000)
+    print(f'{path}, Python middleware:\n> {total}')
+    total = timeit('routes.match_normalized(path)', globals=globals(), number=100000)
+    print(f'{path}, match_normalized:\n> {total}')
+
+print('Mixed tree with a regex placeholder:')
+routes = Routes()
+for name in ('users', 'boats', 'horses'):
+    routes.add(f'/{name}/me', GET=name)
+    routes.add(f'/{name}/{{id:[0-9a-f]+}}', GET=name)
+    routes.add(f'/{name}/{{id}}/profile', GET=name)
+
+total = timeit("routes.match('/horses/me')",
+               globals=globals(), number=100000)
+print(f'Static sibling:\n> {total}')
+
+total = timeit("routes.match('/horses/john/profile')",
+               globals=globals(), number=100000)
+print(f'Typed sibling:\n> {total}')
+
+total = timeit("routes.match('/horses/5f0c1a')",
+               globals=globals(), number=100000)
+print(f'Regex placeholder:\n> {total}')
+
+print('Frozen routes (4000 routes):')
+routes = Routes()
+routes.add_many((path, {'GET': path}) for path in registration_paths(4000))
+frozen = routes.freeze()
+for name, obj in (('Routes', routes), ('FrozenRoutes', frozen)):
+    total = timeit("obj.match('resource900/22/subpath')",
+                   globals=globals(), number=100000)
+    print(f'{name}, path with placeholder:\n> {total}')
+    total = timeit("obj.match('resource900/')",
+                   globals=globals(), number=100000)
+    print(f'{name}, flat path:\n> {total}')
+print(f'FrozenRoutes table size:\n> {len(frozen.table)} bytes')
+
+with tempfile.TemporaryDirectory() as tmp:
+    frozen.dump(f'{tmp}/routes.bin')
+    total = timeit(f"FrozenRoutes.load('{tmp}/routes.bin')",
+                   globals=globals(), number=1)
+    print(f'FrozenRoutes.load:\n> {total}')
+
+# Only scales on free-threaded Python builds, with as many cores.
+print('Threads (4000 routes, 100k matches per thread):')
+for count in (1, 2, 4, 8):
+
+    def worker():
+        for _ in range(100000):
+            routes.match('resource900/22/subpath')
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f'{count} threads:\n> {count * 100000 / elapsed:.0f} matches/s')
+
+print('Threads, with a concurrent writer:')
+for count in (1, 4):
+    stop = threading.Event()
+
+    def writer():
+        while not stop.is_set():
+            routes.add('resource0/{id}/other', GET='x')
+            routes.remove('resource0/{id}/other')
+
+    def worker():
+        for _ in range(100000):
+            routes.match('resource900/22/subpath')
+
+    writing = threading.Thread(target=writer)
+    writing.start()
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    writing.join()
+    print(f'{count} threads:\n> {count * 100000 / elapsed:.0f} matches/s')
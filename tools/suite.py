@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+"""Benchmark suite, on generated route sets shaped like real applications.
+
+Unlike bench.py, which times a few calls on toy routes, this measures for each
+route set the registration time, the match latency percentiles (static hits,
+hits with params, misses, scanner probes) and the memory per route, and can save the results
+as JSON, to compare them between versions:
+
+    python tools/suite.py --json before.json
+    # Change things, rebuild.
+    python tools/suite.py --compare before.json
+
+With --compare, the exit status is 1 if a metric regressed more than the
+threshold (all metrics are lower is better).
+"""
+
+import argparse
+import json
+import platform
+import random
+import string
+import sys
+import time
+import tracemalloc
+from uuid import UUID
+
+from autoroutes import Routes
+
+SEED = 1234
+
+# Sample values for each placeholder type, to build matching paths.
+SAMPLES = {
+    'string': lambda rng: ''.join(rng.choices(string.ascii_lowercase + '-', k=8)),
+    'alnum': lambda rng: ''.join(rng.choices(string.ascii_letters + string.digits, k=8)),
+    'alpha': lambda rng: ''.join(rng.choices(string.ascii_letters, k=6)),
+    'digit': lambda rng: str(rng.randrange(1, 100000)),
+    'int': lambda rng: str(rng.randrange(1, 100000)),
+    'float': lambda rng: f'{rng.randrange(100)}.{rng.randrange(100)}',
+    'uuid': lambda rng: str(UUID(int=rng.getrandbits(128))),
+    'path': lambda rng: '/'.join(rng.choices(['docs', 'src', 'a', 'b', 'c'], k=3)),
+}
+# Same, for the custom regexes used in the route sets.
+REGEX_SAMPLES = {
+    r'[0-9a-f]+': 'c0ffee',
+    r'[A-Z][a-z]+': 'Alice',
+    r'v[0-9]+\.[0-9]+': 'v1.2',
+    r'[a-z]+-[0-9]+': 'abc-123',
+}
+
+# A subset of the GitHub REST API.
+GITHUB = [
+    '/user', '/user/repos', '/user/orgs', '/user/keys', '/user/keys/{key_id:int}',
+    '/user/emails', '/user/followers', '/user/following/{username}',
+    '/users/{username}', '/users/{username}/repos', '/users/{username}/orgs',
+    '/users/{username}/gists', '/users/{username}/followers',
+    '/users/{username}/following/{target_user}', '/users/{username}/events/public',
+    '/orgs/{org}', '/orgs/{org}/repos', '/orgs/{org}/members',
+    '/orgs/{org}/members/{username}', '/orgs/{org}/teams',
+    '/orgs/{org}/teams/{team_slug}', '/orgs/{org}/teams/{team_slug}/members',
+    '/orgs/{org}/hooks/{hook_id:int}', '/orgs/{org}/actions/secrets/{secret_name}',
+    '/repos/{owner}/{repo}', '/repos/{owner}/{repo}/issues',
+    '/repos/{owner}/{repo}/issues/{issue_number:int}',
+    '/repos/{owner}/{repo}/issues/{issue_number:int}/comments',
+    '/repos/{owner}/{repo}/issues/{issue_number:int}/labels/{name}',
+    '/repos/{owner}/{repo}/issues/comments/{comment_id:int}',
+    '/repos/{owner}/{repo}/pulls', '/repos/{owner}/{repo}/pulls/{pull_number:int}',
+    '/repos/{owner}/{repo}/pulls/{pull_number:int}/files',
+    '/repos/{owner}/{repo}/pulls/{pull_number:int}/reviews/{review_id:int}',
+    '/repos/{owner}/{repo}/commits', '/repos/{owner}/{repo}/commits/{ref}',
+    '/repos/{owner}/{repo}/commits/{ref}/statuses', '/repos/{owner}/{repo}/branches',
+    '/repos/{owner}/{repo}/branches/{branch}/protection',
+    '/repos/{owner}/{repo}/contents/{path:path}', '/repos/{owner}/{repo}/releases',
+    '/repos/{owner}/{repo}/releases/latest',
+    '/repos/{owner}/{repo}/releases/{release_id:int}',
+    '/repos/{owner}/{repo}/releases/{release_id:int}/assets',
+    '/repos/{owner}/{repo}/actions/runs', '/repos/{owner}/{repo}/actions/runs/{run_id:int}',
+    '/repos/{owner}/{repo}/actions/runs/{run_id:int}/logs',
+    '/repos/{owner}/{repo}/actions/workflows/{workflow_id}/runs',
+    '/repos/{owner}/{repo}/git/refs/{ref:path}', '/repos/{owner}/{repo}/git/trees/{tree_sha}',
+    '/repos/{owner}/{repo}/git/blobs/{file_sha}', '/repos/{owner}/{repo}/stargazers',
+    '/repos/{owner}/{repo}/hooks/{hook_id:int}/pings', '/repos/{owner}/{repo}/tarball/{ref}',
+    '/gists', '/gists/public', '/gists/{gist_id}', '/gists/{gist_id}/comments',
+    '/gists/{gist_id}/{sha}', '/search/repositories', '/search/issues', '/search/users',
+    '/notifications', '/notifications/threads/{thread_id:int}', '/rate_limit', '/meta',
+    '/emojis', '/events', '/feeds', '/licenses/{license}',
+]
+
+# Paths probed by vulnerability scanners, the bulk of the 404s in production.
+SCANNER = [
+    '/wp-login.php', '/wp-admin/install.php', '/xmlrpc.php', '/.env', '/.git/config',
+    '/.aws/credentials', '/config.json', '/phpmyadmin/index.php', '/admin.php',
+    '/cgi-bin/luci', '/server-status', '/actuator/health', '/console/', '/HNAP1/',
+    '/owa/auth/logon.aspx', '/boaform/admin/formLogin', '/solr/admin/info/system',
+    '/vendor/phpunit/phpunit/src/Util/PHP/eval-stdin.php',
+    '/index.php?s=/Index/think/app/invokefunction', '/../../../../../../etc/passwd',
+    '/' + 'A' * 512,
+]
+
+
+def fill(pattern, rng):
+    """Return a path matched by `pattern`, with random placeholder values."""
+    parts = []
+    end = -1
+    while True:
+        start = pattern.find('{', end + 1)
+        if start == -1:
+            break
+        parts.append(pattern[end + 1:start])
+        end = pattern.find('}', start)
+        _, _, match_type = pattern[start + 1:end].partition(':')
+        sample = SAMPLES.get(match_type or 'string')
+        parts.append(sample(rng) if sample else REGEX_SAMPLES[match_type])
+    parts.append(pattern[end + 1:])
+    return ''.join(parts)
+
+
+def github(size, rng):
+    """GitHub API like, repeated under as many static prefixes as needed."""
+    patterns = []
+    for i in range(size // len(GITHUB) + 1):
+        prefix = f'/api{i}' if i else ''
+        patterns.extend(prefix + pattern for pattern in GITHUB)
+    return patterns[:size]
+
+
+def wide(size, rng):
+    """Many siblings at the root, each with a placeholder child."""
+    patterns = []
+    for i in range(size // 2):
+        name = ''.join(rng.choices(string.ascii_lowercase, k=6))
+        patterns.append(f'/{name}{i}')
+        patterns.append(f'/{name}{i}/{{id}}')
+    return patterns
+
+
+def deep(size, rng):
+    """Long nested paths, with a route at each level."""
+    patterns = []
+    branch = 0
+    while len(patterns) < size:
+        pattern = f'/branch{branch}'
+        for level in range(10):
+            pattern += f'/level{level}/{{id{level}}}'
+            patterns.append(pattern)
+        branch += 1
+    return patterns[:size]
+
+
+def regex(size, rng):
+    """Custom regex placeholders, the slowest to match."""
+    regexes = list(REGEX_SAMPLES)
+    patterns = []
+    for i in range(size // 2):
+        pattern = f'/res{i}/{{id:{regexes[i % len(regexes)]}}}'
+        patterns.append(pattern)
+        patterns.append(f'{pattern}/items/{{item:digit}}')
+    return patterns
+
+
+def mixed(size, rng):
+    """All placeholder types, with prefixes and suffixes."""
+    templates = [
+        '/shop{i}/products/{id:int}', '/shop{i}/products/{id:int}.json',
+        '/shop{i}/orders/{uid:uuid}', '/shop{i}/categories/{name:alpha}',
+        '/shop{i}/prices/{amount:float}', '/shop{i}/files/{path:path}',
+        '/shop{i}/tags/{tag:alnum}', '/shop{i}/users/{id:digit}/avatar.png',
+        '/shop{i}/about', '/shop{i}/v{version:digit}/status',
+    ]
+    patterns = []
+    for i in range(size // len(templates) + 1):
+        patterns.extend(template.replace('{i}', str(i)) for template in templates)
+    return patterns[:size]
+
+
+ROUTE_SETS = {
+    'github': github,
+    'wide': wide,
+    'deep': deep,
+    'regex': regex,
+    'mixed': mixed,
+}
+
+
+def build_hits(patterns, rng):
+    """Return a path matched by each pattern, as (static hits, hits with params)."""
+    static_hits = []
+    param_hits = []
+    for pattern in patterns:
+        (param_hits if '{' in pattern else static_hits).append(fill(pattern, rng))
+    return static_hits, param_hits
+
+
+def build_misses(routes, hits, rng):
+    """Near misses (a known prefix with an unknown end) and unknown roots."""
+    misses = []
+    for path in hits:
+        for miss in (path + '/unknown', '/unknown' + path):
+            if routes.match(miss) == (None, None):
+                misses.append(miss)
+    rng.shuffle(misses)
+    return misses
+
+
+def build_junk(routes, hits, rng):
+    """Scanner probes, at the root and under the first segment of known paths."""
+    prefixes = {''} | {'/' + path.split('/')[1] for path in rng.sample(hits, min(len(hits), 50))}
+    return [prefix + probe for prefix in sorted(prefixes) for probe in SCANNER
+            if routes.match(prefix + probe) == (None, None)]
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    last = len(timings) - 1
+    return {
+        'p50_ns': timings[last // 2],
+        'p90_ns': timings[last * 9 // 10],
+        'p99_ns': timings[last * 99 // 100],
+        'mean_ns': sum(timings) / len(timings),
+    }
+
+
+def latencies(match, paths, inner):
+    """Time `inner` calls per path, to get above the timer resolution."""
+    timings = []
+    clock = time.perf_counter_ns
+    loop = range(inner)
+    for path in paths:
+        start = clock()
+        for _ in loop:
+            match(path)
+        timings.append((clock() - start) / inner)
+    return timings
+
+
+def best(func, repeat):
+    """Return the best wall time of `repeat` calls to `func`."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_set(name, size, repeat, inner, max_paths):
+    rng = random.Random(SEED)
+    patterns = ROUTE_SETS[name](size, rng)
+    static_hits, param_hits = build_hits(patterns, rng)
+    routes_list = [(pattern, {'GET': i}) for i, pattern in enumerate(patterns)]
+    results = {'routes': len(routes_list)}
+
+    def add():
+        routes = Routes()
+        for path, payload in routes_list:
+            routes.add(path, **payload)
+
+    results['register.add_s'] = best(add, repeat)
+    results['register.add_many_s'] = best(lambda: Routes().add_many(routes_list), repeat)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    routes = Routes()
+    routes.add_many(routes_list)
+    results['memory.bytes_per_route'] = (
+        (tracemalloc.get_traced_memory()[0] - before) / len(routes_list))
+    tracemalloc.stop()
+
+    results['register.freeze_s'] = best(routes.freeze, repeat)
+    frozen = routes.freeze()
+    results['memory.frozen_bytes_per_route'] = len(frozen.table) / len(routes_list)
+
+    misses = build_misses(routes, static_hits + param_hits, rng)
+    categories = {
+        'static': static_hits,
+        'params': param_hits,
+        'miss': misses,
+        'junk': build_junk(routes, static_hits + param_hits, rng),
+    }
+    for engine, match in (('match', routes.match), ('frozen', frozen.match)):
+        for category, paths in categories.items():
+            if not paths:
+                continue
+            paths = rng.sample(paths, min(len(paths), max_paths))
+            timings = []
+            for _ in range(repeat):
+                timings.extend(latencies(match, paths, inner))
+            for key, value in percentiles(timings).items():
+                results[f'{engine}.{category}.{key}'] = value
+    return results
+
+
+def metadata():
+    import autoroutes
+    try:
+        from importlib.metadata import version
+        autoroutes_version = version('autoroutes')
+    except Exception:
+        autoroutes_version = None
+    return {
+        'autoroutes': autoroutes_version,
+        'module': autoroutes.__file__,
+        'python': sys.version,
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def format_value(key, value):
+    if key.endswith('_s'):
+        return f'{value * 1000:.2f} ms'
+    if key.endswith('_ns'):
+        return f'{value:.0f} ns'
+    if key.startswith('memory.'):
+        return f'{value:.0f} B'
+    return str(value)
+
+
+def report(results):
+    for name, metrics in results.items():
+        print(f'{name}:')
+        for key, value in metrics.items():
+            print(f'  {key}: {format_value(key, value)}')
+
+
+def compare(results, previous, threshold):
+    """Print the ratio of each metric to the previous run, return the regressions."""
+    regressions = []
+    for name, metrics in results.items():
+        before = previous.get(name)
+        if before is None:
+            continue
+        print(f'{name}:')
+        for key, value in metrics.items():
+            old = before.get(key)
+            if not old or key == 'routes':
+                continue
+            ratio = value / old
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  REGRESSION'
+                regressions.append(f'{name}.{key}')
+            elif ratio < 1 - threshold:
+                flag = '  improvement'
+            print(f'  {key}: {format_value(key, old)} -> {format_value(key, value)}'
+                  f' ({ratio:.2f}x){flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sets', nargs='+', choices=ROUTE_SETS, default=list(ROUTE_SETS),
+                        help='route sets to run (default: all)')
+    parser.add_argument('--size', type=int, default=4000,
+                        help='number of routes per set (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each measure (default: %(default)s)')
+    parser.add_argument('--inner', type=int, default=20,
+                        help='calls per timed path (default: %(default)s)')
+    parser.add_argument('--max-paths', type=int, default=2000,
+                        help='paths timed per category (default: %(default)s)')
+    parser.add_argument('--json', metavar='PATH', help='save the results to PATH')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare with the results saved in PATH')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='ratio above which a metric regressed (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.sets:
+        results[name] = run_set(name, args.size, args.repeat, args.inner, args.max_paths)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': metadata(), 'size': args.size, 'results': results}, f,
+                      indent=2)
+    if not args.compare:
+        report(results)
+        return 0
+    with open(args.compare) as f:
+        previous = json.load(f)
+    if previous.get('size') != args.size:
+        print(f'Warning: comparing {args.size} routes to {previous.get("size")}')
+    regressions = compare(results, previous['results'], args.threshold)
+    if regressions:
+        print(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())